@@ -1,73 +1,885 @@
-from flask import Flask, render_template, request, send_from_directory, jsonify
+from flask import Flask, Response, render_template, request, send_from_directory, jsonify, url_for
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
 from werkzeug.utils import secure_filename
 import os
+import hashlib
+import io
 import json
 import logging
+import multiprocessing
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from generate_character_sheet import fill_template, load_json_data
+from generate_character_sheet import (LAZY_SECTIONS, check_export_member, expand_lazy_sections, fragment_cache,
+                                      load_json_chunks, load_json_stream, render_plan, stream_sheet_parts,
+                                      template_stylesheet, template_version, timed, warmup)
+from render_budget import MemoryBudget, OverBudget
+from render_cache import RenderCache, content_key
+from render_jobs import MemoryJobStore, QueueFull, RenderQueue, SqliteJobStore
+from render_metrics import Metrics, server_timing
+from sheet_store import SheetStore
+from sheet_variants import choose_encoding, compress_variants, variant_etag
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-UPLOAD_FOLDER = 'uploads'
+# Sheets written before the sheet store are still served from here
 OUTPUT_FOLDER = 'outputs'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+TEMPLATE_FILE = 'character_template.html'
+
+# 'disk' keeps uploads and sheets in the sheet store; 'memory' parses the
+# upload stream directly and keeps rendered sheets in this process only
+UPLOAD_MODE = os.environ.get('UPLOAD_MODE', 'disk')
+MEMORY_SHEET_LIMIT = int(os.environ.get('MEMORY_SHEET_LIMIT', '64'))
+memory_sheets = OrderedDict()
+memory_sheets_lock = threading.Lock()
+
+# Content-addressed uploads and sheets shared by every worker, capped at
+# STORAGE_MAX_BYTES; anything unused for STORAGE_TTL seconds (0: never) is dropped
+STORAGE_FOLDER = os.environ.get('STORAGE_FOLDER', 'storage')
+STORAGE_MAX_BYTES = int(os.environ.get('STORAGE_MAX_BYTES', str(512 * 1024 * 1024)))
+STORAGE_TTL = int(os.environ.get('STORAGE_TTL', str(7 * 24 * 3600)))
+sheet_store = SheetStore(STORAGE_FOLDER, STORAGE_MAX_BYTES, STORAGE_TTL) if UPLOAD_MODE != 'memory' else None
+
+def remember_sheet(filename, sheet):
+    """Keep a rendered sheet's (etag, variants) in memory, evicting the least recently used"""
+    with memory_sheets_lock:
+        memory_sheets[filename] = sheet
+        memory_sheets.move_to_end(filename)
+        while len(memory_sheets) > MEMORY_SHEET_LIMIT:
+            memory_sheets.popitem(last=False)
+
+def recall_sheet(filename):
+    """Return a sheet rendered in memory mode, or None if this process lacks it"""
+    with memory_sheets_lock:
+        sheet = memory_sheets.get(filename)
+        if sheet is not None:
+            memory_sheets.move_to_end(filename)
+        return sheet
+
+# Per-stage and per-section upload timings, sent as Server-Timing and kept for /metrics
+RENDER_TIMING = os.environ.get('RENDER_TIMING', '1').lower() in ('1', 'true', 'yes')
+metrics = Metrics()
+metrics.describe('charactercraft_http_requests_total', 'Requests by endpoint and status code')
+metrics.describe('charactercraft_response_bytes_total', 'Response body bytes by endpoint, excluding streamed responses')
+metrics.describe('charactercraft_upload_bytes_total', 'Uploaded export bytes')
+metrics.describe('charactercraft_upload_rejected_total', 'Uploads refused while streaming, by status code')
+metrics.describe('charactercraft_upload_seconds', 'Time to handle POST /upload')
+metrics.describe('charactercraft_stage_seconds', 'Time spent in each stage of an upload')
+metrics.describe('charactercraft_section_seconds', 'Time to compute each template section')
+
+# Uploads are parsed as they arrive; exports larger than this get 413 without being read in full
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(16 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+# Renders in flight may hold at most RENDER_MEMORY_BUDGET estimated bytes per
+# process; the rest wait up to ADMISSION_WAIT seconds (ADMISSION_QUEUE of them)
+# and are then refused with 503. Set RENDER_MEMORY_BUDGET to 0 to disable.
+RENDER_MEMORY_BUDGET = int(os.environ.get('RENDER_MEMORY_BUDGET', str(256 * 1024 * 1024)))
+ADMISSION_WAIT = float(os.environ.get('ADMISSION_WAIT', '5'))
+ADMISSION_QUEUE = int(os.environ.get('ADMISSION_QUEUE', '16'))
+render_budget = MemoryBudget(RENDER_MEMORY_BUDGET, ADMISSION_QUEUE) if RENDER_MEMORY_BUDGET else None
+
+# Render cost model, measured with tracemalloc on scaled-up exports: the upload
+# is held as chunks and joined bytes next to its parsed tree, and every spell,
+# item, feature or note adds its share of the sheet and variant pages
+RENDER_BASE_BYTES = 512 * 1024
+RENDER_BYTES_PER_UPLOAD_BYTE = 4
+RENDER_BYTES_PER_ITEM = 8 * 1024
+RENDER_LIST_FIELDS = ('spells', 'equipment', 'featuresAndTraits', 'feats', 'notes', 'archivedNotes')
+
+# Keep only the export fields the renderer reads (see RENDER_FIELDS); parsing
+# is slower than a full load but the parsed tree is much smaller
+SELECTIVE_JSON = os.environ.get('SELECTIVE_JSON', '').lower() in ('1', 'true', 'yes')
+
+# Re-render only the sections whose inputs changed when a character id is re-uploaded
+INCREMENTAL_RENDER = os.environ.get('INCREMENTAL_RENDER', '').lower() in ('1', 'true', 'yes')
+
+# Rendered sheets shared by every worker, keyed on template version + upload bytes.
+# Set RENDER_CACHE_PATH to an empty string to disable.
+RENDER_CACHE_PATH = os.environ.get('RENDER_CACHE_PATH', os.path.join('cache', 'renders.sqlite3'))
+RENDER_CACHE_BYTES = int(os.environ.get('RENDER_CACHE_BYTES', str(64 * 1024 * 1024)))
+render_cache = RenderCache(RENDER_CACHE_PATH, RENDER_CACHE_BYTES) if RENDER_CACHE_PATH else None
+
+# 'inline' embeds the template CSS in every sheet; 'linked' points sheets at one
+# fingerprinted stylesheet under STYLESHEET_PREFIX and minifies them (MINIFY_HTML).
+# /download always hands out a self-contained copy.
+SHEET_STYLE = os.environ.get('SHEET_STYLE', 'inline')
+MINIFY_HTML = os.environ.get('MINIFY_HTML', '1' if SHEET_STYLE == 'linked' else '').lower() in ('1', 'true', 'yes')
+STYLESHEET_PREFIX = '/sheet-assets/'
+stylesheet_variants = {}
+
+def sheet_render_options():
+    """stylesheet_url/minify arguments for render_sheet in the configured output mode"""
+    stylesheet_url = None
+    if SHEET_STYLE == 'linked':
+        stylesheet_url = STYLESHEET_PREFIX + template_stylesheet(TEMPLATE_FILE)[1]
+    return {'stylesheet_url': stylesheet_url, 'minify': MINIFY_HTML}
+
+# Ship spell details and inventory as collapsed placeholders that fetch
+# /view/<file>/section/<name> when opened
+LAZY_RENDER = os.environ.get('LAZY_SECTIONS', '').lower() in ('1', 'true', 'yes')
+
+# Extra pages rendered from the same upload in one pass with the sheet and
+# served by /view/<file>?variant=<name>. Off by default, since each one is
+# compressed and stored with every new sheet; e.g. SHEET_VARIANTS=print,summary
+VARIANT_TEMPLATES = {'print': 'print_template.html', 'summary': 'summary_template.html'}
+SHEET_VARIANTS = {name: VARIANT_TEMPLATES[name]
+                  for name in os.environ.get('SHEET_VARIANTS', '').split(',') if name in VARIANT_TEMPLATES}
+
+def sheet_filename(character_name, etag):
+    """Output file name for a character's sheet
+    
+    The ETag prefix keeps two characters with the same name from sharing a file.
+    """
+    safe_name = secure_filename(character_name) if character_name else 'character'
+    return f"{safe_name}_{etag[:8]}_sheet.html"
+
+def section_filename(filename, name):
+    """Name a deferred section of a sheet is stored under"""
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{name}{ext}"
+
+def section_url(filename, name):
+    return f"/view/{filename}/section/{name}"
+
+def cached_render(cache_key, etag):
+    """(character_name, html, fragments) from the render cache, or None"""
+    cached = render_cache.get(cache_key) if render_cache else None
+    if not cached:
+        return None
+    character_name, html = cached
+    fragments = {}
+    for name in [*LAZY_SECTIONS, *SHEET_VARIANTS]:
+        if name in SHEET_VARIANTS or section_url(sheet_filename(character_name, etag), name) in html:
+            fragment = render_cache.get(f"{cache_key}#{name}")
+            if fragment is None:
+                # Evicted separately from its page
+                return None
+            fragments[name] = fragment[1]
+    return character_name, html, fragments
+
+def render_key(raw):
+    """(render options, render cache key, ETag) for an upload in the configured output mode"""
+    options = sheet_render_options()
+    version = template_version(TEMPLATE_FILE, **options)
+    for template_file in SHEET_VARIANTS.values():
+        version += ':' + template_version(template_file, minify=MINIFY_HTML)
+    cache_key = content_key(raw, f"{version}:lazy" if LAZY_RENDER else version)
+    # The render key already names this exact output, so it doubles as the ETag
+    return options, cache_key, cache_key.split(':', 1)[1][:32]
+
+def export_items(key, value):
+    """How many spells, items, features or notes a top-level export member adds to the render"""
+    if key in RENDER_LIST_FIELDS and isinstance(value, list):
+        return len(value)
+    if key == 'species' and isinstance(value, dict) and isinstance(value.get('traits'), list):
+        return len(value['traits'])
+    return 0
+
+def render_cost(upload_bytes, items=None):
+    """Estimated peak bytes of rendering an upload, from its size and, once read, its entry count"""
+    if items is None:
+        # Before reading, assume the usual ratio of list entries to export bytes
+        return RENDER_BASE_BYTES + upload_bytes * (RENDER_BYTES_PER_UPLOAD_BYTE + 3)
+    return RENDER_BASE_BYTES + upload_bytes * RENDER_BYTES_PER_UPLOAD_BYTE + items * RENDER_BYTES_PER_ITEM
+
+def admit_render(cost, timeout=ADMISSION_WAIT):
+    """Reservation of cost bytes in the render budget; raises OverBudget when it cannot be had in time"""
+    if render_budget is None:
+        return None
+    return render_budget.reserve(cost, timeout)
+
+def release_render(reservation):
+    if reservation is not None:
+        reservation.release()
+
+def budgeted_render(raw, upload_name):
+    """render_upload for a background job, waiting for room in the render budget as long as it takes"""
+    reservation = admit_render(render_cost(len(raw)), timeout=None)
+    try:
+        return render_upload(raw, upload_name)
+    finally:
+        release_render(reservation)
+
+def save_upload(raw, upload_name, timings=None):
+    """Keep a copy of the uploaded export in the sheet store (disk mode only)"""
+    if sheet_store:
+        upload_key = f"uploads/{hashlib.sha256(raw).hexdigest()}.json"
+        logger.info(f"Storing upload {upload_name} as {upload_key}")
+        with timed(timings, 'save'):
+            sheet_store.put(upload_key, {'identity': raw})
+
+def cache_render(cache_key, character_name, html, fragments):
+    """Add a freshly rendered sheet to the render cache"""
+    if render_cache:
+        # Fragments first, so a reader that finds the page also finds them
+        for name, fragment in fragments.items():
+            render_cache.put(f"{cache_key}#{name}", character_name, fragment)
+        render_cache.put(cache_key, character_name, html)
+
+def parse_upload(raw, timings=None):
+    """The export tree of an upload's raw bytes, built once a render cache miss needs it"""
+    logger.info("Loading JSON data")
+    with timed(timings, 'parse'):
+        return load_json_stream(io.BytesIO(raw), SELECTIVE_JSON)
+
+def render_upload(raw, upload_name, timings=None):
+    """Turn raw upload bytes into (character_name, output_filename, html, etag, fragments)
+    
+    fragments holds, by name, the HTML of sections deferred with LAZY_SECTIONS
+    and the SHEET_VARIANTS pages; both are stored next to the sheet. The
+    export is only parsed on a render cache miss.
+    If timings is a dict, the seconds spent in each stage are added to it.
+    """
+    options, cache_key, etag = render_key(raw)
+    with timed(timings, 'cache'):
+        cached = cached_render(cache_key, etag)
+    if cached:
+        character_name, html, fragments = cached
+        logger.info(f"Render cache hit for {upload_name}")
+    else:
+        save_upload(raw, upload_name, timings)
+        data = parse_upload(raw, timings)
+        character_name = data.get('name', 'character')
+        logger.info(f"Generating character sheet for: {character_name}")
+        output_filename = sheet_filename(character_name, etag)
+        pages, fragments = render_plan(
+            data, [TEMPLATE_FILE, *SHEET_VARIANTS.values()], INCREMENTAL_RENDER, **options,
+            section_url=(lambda name: section_url(output_filename, name)) if LAZY_RENDER else None,
+            timings=timings)
+        html = pages[0]
+        fragments.update(zip(SHEET_VARIANTS, pages[1:]))
+        cache_render(cache_key, character_name, html, fragments)
+    
+    return character_name, sheet_filename(character_name, etag), html, etag, fragments
+
+def stream_upload(raw, upload_name, timings=None):
+    """(output_filename, chunks) for an upload whose sheet is sent while it renders
+    
+    chunks yields the page in document order (see stream_sheet_parts); once
+    the last one is out the sheet is cached and stored as for render_upload.
+    """
+    options, cache_key, etag = render_key(raw)
+    with timed(timings, 'cache'):
+        cached = cached_render(cache_key, etag)
+    if cached:
+        character_name, html, fragments = cached
+        output_filename = sheet_filename(character_name, etag)
+        logger.info(f"Render cache hit for {upload_name}")
+        store_sheet(output_filename, html, etag, fragments)
+        return output_filename, iter([html])
+    
+    save_upload(raw, upload_name, timings)
+    data = parse_upload(raw, timings)
+    character_name = data.get('name', 'character')
+    output_filename = sheet_filename(character_name, etag)
+    fragments = {}
+    sections = {}
+    chunks = stream_sheet_parts(
+        data, TEMPLATE_FILE, INCREMENTAL_RENDER, **options,
+        section_url=(lambda name: section_url(output_filename, name)) if LAZY_RENDER else None,
+        fragments=fragments, timings=timings, sections=sections)
+    
+    def generate():
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+            html = ''.join(parts)
+            if SHEET_VARIANTS:
+                # Reuses the sections the stream computed
+                pages, _ = render_plan(data, list(SHEET_VARIANTS.values()), INCREMENTAL_RENDER,
+                                       minify=MINIFY_HTML, timings=timings, template_data=sections)
+                fragments.update(zip(SHEET_VARIANTS, pages))
+            cache_render(cache_key, character_name, html, fragments)
+            with timed(timings, 'store'):
+                store_sheet(output_filename, html, etag, fragments)
+        except Exception as e:
+            logger.error(f"Error streaming {output_filename}: {e}", exc_info=True)
+            raise
+        logger.info(f"Successfully streamed: {output_filename}")
+    
+    logger.info(f"Streaming character sheet for: {character_name}")
+    return output_filename, generate()
+
+def stored_etag(filename):
+    """ETag of the sheet or fragment stored under filename, or None"""
+    if sheet_store:
+        entry = sheet_store.get(filename)
+        return entry[0] if entry else None
+    sheet = recall_sheet(filename)
+    return sheet[0] if sheet else None
+
+def store_sheet(output_filename, html, etag, fragments=None):
+    """Keep a rendered sheet and its compressed variants where /view and /download will look for them"""
+    parts = [(output_filename, html, etag)]
+    for name, fragment in (fragments or {}).items():
+        parts.append((section_filename(output_filename, name), fragment, f"{etag}-{name}"))
+    # The page goes last, so its placeholders never point at missing fragments
+    for filename, body, tag in reversed(parts):
+        if stored_etag(filename) == tag:
+            # Names carry the ETag, so a re-upload (e.g. a render cache hit) finds its sheet already stored
+            continue
+        variants = compress_variants(body.encode('utf-8'))
+        if sheet_store:
+            logger.info(f"Storing character sheet: {filename}")
+            sheet_store.put(filename, variants, tag, group=output_filename)
+        else:
+            remember_sheet(filename, (tag, variants))
+
+def find_sheet(filename):
+    """(etag, encodings, read) for a stored sheet or fragment, or None
+    
+    read(encoding) returns that variant's bytes, or None if it was evicted meanwhile.
+    """
+    sheet = recall_sheet(filename)
+    if sheet is not None:
+        etag, variants = sheet
+        return etag, variants.keys(), variants.get
+    entry = sheet_store.get(filename) if sheet_store else None
+    if entry is not None:
+        etag, digests = entry
+        return etag, digests.keys(), lambda encoding: sheet_store.read(digests[encoding])
+    return None
+
+def read_stored(filename):
+    """Uncompressed bytes of a stored sheet or fragment, or None"""
+    sheet = find_sheet(filename)
+    return sheet[2]('identity') if sheet else None
+
+def offline_html(html, fragments):
+    """Self-contained copy of a sheet: deferred sections filled in and CSS inline"""
+    if fragments:
+        html = expand_lazy_sections(html, fragments)
+    if SHEET_STYLE == 'linked':
+        css, name = template_stylesheet(TEMPLATE_FILE)
+        html = html.replace(f'<link rel="stylesheet" href="{STYLESHEET_PREFIX}{name}">', f'<style>{css}</style>', 1)
+    return html
+
+def offline_copy(filename, body):
+    """offline_html for a stored sheet, as bytes"""
+    fragments = {}
+    for name in LAZY_SECTIONS:
+        fragment = read_stored(section_filename(filename, name))
+        if fragment is not None:
+            fragments[name] = fragment.decode('utf-8')
+    return offline_html(body.decode('utf-8'), fragments).encode('utf-8')
+
+def send_sheet(filename, sheet, as_attachment=False):
+    """Serve a find_sheet result in the best encoding the client accepts, or 304 if it is unchanged"""
+    etag, encodings, read = sheet
+    # Downloads are for offline use, so linked or lazy sheets are made whole again
+    offline = as_attachment and (SHEET_STYLE == 'linked' or LAZY_RENDER)
+    encoding = 'identity' if offline else choose_encoding(request.accept_encodings, encodings)
+    
+    etag = variant_etag(etag, 'offline' if offline else encoding)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = read(encoding)
+        if body is None:
+            return jsonify({'error': 'File not found'}), 404
+        if offline:
+            body = offline_copy(filename, body)
+        response = Response(body, mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        if as_attachment:
+            response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Sheet names carry the render's ETag (see sheet_filename), so a name never
+    # serves different content; a re-upload that renders differently gets a new one
+    response.headers['Cache-Control'] = 'max-age=31536000, immutable'
+    return response
+
+# Process pool for rendering several exports at once, created on first use
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', '0')) or None
+BULK_MAX_FILES = int(os.environ.get('BULK_MAX_FILES', '50'))
+BULK_MAX_FILE_BYTES = int(os.environ.get('BULK_MAX_FILE_BYTES', str(16 * 1024 * 1024)))
+render_pool = None
+render_pool_lock = threading.Lock()
+
+def get_render_pool():
+    """Return the shared render process pool, starting it if needed"""
+    global render_pool
+    with render_pool_lock:
+        if render_pool is None:
+            # spawn, because forking a threaded server can copy held locks
+            render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS,
+                                              mp_context=multiprocessing.get_context('spawn'))
+        return render_pool
+
+# Background render jobs for /upload?async=1 (or every upload with ASYNC_RENDER=1).
+# RENDER_QUEUE_BACKEND=process runs them on the render process pool instead of threads.
+ASYNC_RENDER = os.environ.get('ASYNC_RENDER', '').lower() in ('1', 'true', 'yes')
+RENDER_QUEUE_DEPTH = int(os.environ.get('RENDER_QUEUE_DEPTH', '32'))
+RENDER_QUEUE_WORKERS = int(os.environ.get('RENDER_QUEUE_WORKERS', '2'))
+RENDER_QUEUE_BACKEND = os.environ.get('RENDER_QUEUE_BACKEND', 'thread')
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', os.path.join('cache', 'jobs.sqlite3'))
+render_queue = None
+render_queue_lock = threading.Lock()
+
+def finish_render_job(result):
+    """Store a background render's sheet and return the record /status reports"""
+    character_name, output_filename, html, etag, fragments = result
+    store_sheet(output_filename, html, etag, fragments)
+    return {'character_name': character_name, 'output_file': output_filename}
+
+def get_render_queue():
+    """Return the background render queue, starting it if needed"""
+    global render_queue
+    with render_queue_lock:
+        if render_queue is None:
+            executor = get_render_pool() if RENDER_QUEUE_BACKEND == 'process' else None
+            store = SqliteJobStore(JOB_DB_PATH) if JOB_DB_PATH else MemoryJobStore()
+            render_queue = RenderQueue(RENDER_QUEUE_DEPTH, RENDER_QUEUE_WORKERS, executor,
+                                       store, finish_render_job)
+        return render_queue
+
+def record_upload_timings(timings, elapsed):
+    """Feed an upload's stage and section timings into /metrics"""
+    metrics.observe('charactercraft_upload_seconds', elapsed)
+    for name, seconds in timings.items():
+        if name.startswith('section.'):
+            metrics.observe('charactercraft_section_seconds', seconds, section=name[len('section.'):])
+        else:
+            metrics.observe('charactercraft_stage_seconds', seconds, stage=name)
+    timings['total'] = elapsed
+
+class UploadRejected(Exception):
+    """An upload refused while its body was still being read"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class UploadStream:
+    """The file part of a multipart upload, read from the request body only as it is iterated
+
+    Nothing is buffered ahead of the consumer, so whoever stops iterating
+    early (e.g. on a JSON error) leaves the rest of the body unread.
+    """
+
+    def __init__(self, field='file', max_bytes=MAX_UPLOAD_BYTES):
+        self.field = field
+        self.max_bytes = max_bytes
+        self.filename = None
+        self.size = 0
+        self.chunks = []
+        self._decoder = None
+        self._events = None
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype == 'multipart/form-data' and boundary:
+            self._decoder = MultipartDecoder(boundary.encode('latin-1'))
+
+    def _read_events(self):
+        try:
+            while True:
+                event = self._decoder.next_event()
+                if isinstance(event, NeedData):
+                    chunk = request.stream.read(UPLOAD_CHUNK_BYTES)
+                    self._decoder.receive_data(chunk or None)
+                else:
+                    yield event
+                    if isinstance(event, Epilogue):
+                        return
+        except ClientDisconnected:
+            raise UploadRejected("Upload ended before the file was complete")
+        except ValueError as e:
+            raise UploadRejected(f"Malformed multipart upload: {e}")
+
+    def open(self):
+        """Read up to the start of the file part and return its filename, or None if there is none"""
+        if self._decoder is None:
+            return None
+        self._events = self._read_events()
+        for event in self._events:
+            if isinstance(event, File) and event.name == self.field:
+                self.filename = event.filename
+                return self.filename
+        return None
+
+    def __iter__(self):
+        for event in self._events:
+            if not isinstance(event, Data):
+                break
+            self.size += len(event.data)
+            if self.size > self.max_bytes:
+                raise UploadRejected(f"File is larger than {self.max_bytes} bytes", 413)
+            self.chunks.append(event.data)
+            yield event.data
+            if not event.more_data:
+                break
+
+    @property
+    def raw(self):
+        """Every byte of the file part read so far"""
+        return b''.join(self.chunks)
+
+def reject_upload(upload, error):
+    """Error response for an UploadRejected"""
+    metrics.inc('charactercraft_upload_rejected_total', status=error.status)
+    logger.warning(f"Rejected upload {upload.filename} after {upload.size} bytes: {error}")
+    return jsonify({'error': str(error)}), error.status
+
+def read_upload(upload):
+    """Check a CharacterCraft export from an UploadStream, rejecting it at the first problem
+    
+    Members are dropped once checked, so a render cache hit never builds the
+    tree; render_upload parses the raw bytes on a miss. Returns the number of
+    list entries render_cost weighs.
+    """
+    items = 0
+    
+    def check(key, value):
+        nonlocal items
+        check_export_member(key, value)
+        items += export_items(key, value)
+    
+    try:
+        load_json_chunks(upload, check=check, keep=False)
+    except ValueError as e:
+        raise UploadRejected(str(e))
+    return items
+
+def wants_async():
+    """Whether this upload should be rendered as a background job"""
+    return ASYNC_RENDER or request.args.get('async', '').lower() in ('1', 'true', 'yes')
+
+def wants_stream():
+    """Whether the client asked for the rendered HTML to be streamed back as it renders"""
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+def wants_inline():
+    """Whether the client asked for the rendered HTML in the upload response"""
+    return request.args.get('inline', '').lower() in ('1', 'true', 'yes')
+
+@app.after_request
+def count_request(response):
+    endpoint = request.endpoint or 'unknown'
+    metrics.inc('charactercraft_http_requests_total', endpoint=endpoint, status=response.status_code)
+    if not response.is_streamed and response.content_length:
+        metrics.inc('charactercraft_response_bytes_total', response.content_length, endpoint=endpoint)
+    return response
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', sheet_variants=SHEET_VARIANTS)
+
+def render_admitted(upload, filename, started, timings, reservation):
+    """The rest of POST /upload once admitted; the reservation is released when the response is done with it"""
+    streamed = False
+    try:
+        try:
+            with timed(timings, 'read'):
+                items = read_upload(upload)
+        except UploadRejected as e:
+            return reject_upload(upload, e)
+        raw = upload.raw
+        metrics.inc('charactercraft_upload_bytes_total', len(raw))
+        if reservation is not None:
+            reservation.resize(render_cost(len(raw), items))
+        
+        if wants_async() and not (wants_inline() or wants_stream()):
+            # Background jobs wait for their own reservation on the worker
+            render = budgeted_render if render_budget and RENDER_QUEUE_BACKEND != 'process' else render_upload
+            try:
+                job_id = get_render_queue().submit(render, raw, filename)
+            except QueueFull as e:
+                logger.warning(f"Rejected upload: {e}")
+                return jsonify({'error': 'Server is busy, please retry shortly'}), 503, {'Retry-After': '2'}
+            logger.info(f"Queued render job: {job_id}")
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status_url': url_for('job_status', job_id=job_id)
+            }), 202
+        
+        if wants_stream():
+            output_filename, chunks = stream_upload(raw, filename, timings)
+            # Chunked, so the top of the sheet arrives while the rest is rendering
+            response = Response(chunks, mimetype='text/html')
+            response.headers['Content-Location'] = url_for('view_file', filename=output_filename)
+            response.call_on_close(lambda: release_render(reservation))
+            streamed = True
+            if timings is not None:
+                response.call_on_close(lambda: record_upload_timings(timings, time.perf_counter() - started))
+            return response
+        
+        character_name, output_filename, html, etag, fragments = render_upload(raw, filename, timings)
+        logger.info(f"Character name: {character_name}")
+        
+        with timed(timings, 'store'):
+            store_sheet(output_filename, html, etag, fragments)
+        
+        logger.info(f"Successfully generated: {output_filename}")
+        if wants_inline():
+            response = Response(html, mimetype='text/html')
+        else:
+            response = jsonify({
+                'success': True,
+                'output_file': output_filename,
+                'character_name': character_name
+            })
+        if timings is not None:
+            record_upload_timings(timings, time.perf_counter() - started)
+            response.headers['Server-Timing'] = server_timing(timings)
+        return response
+    finally:
+        if not streamed:
+            release_render(reservation)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
     try:
         logger.info("Upload request received")
         
-        if 'file' not in request.files:
+        if request.content_length and request.content_length > MAX_UPLOAD_BYTES + UPLOAD_CHUNK_BYTES:
+            metrics.inc('charactercraft_upload_rejected_total', status=413)
+            logger.warning(f"Upload too large: {request.content_length} bytes")
+            return jsonify({'error': f"File is larger than {MAX_UPLOAD_BYTES} bytes"}), 413
+        
+        upload = UploadStream()
+        try:
+            filename = upload.open()
+        except UploadRejected as e:
+            return reject_upload(upload, e)
+        if filename is None:
             logger.warning("No file in request")
             return jsonify({'error': 'No file provided'}), 400
         
-        file = request.files['file']
-        logger.info(f"File received: {file.filename}")
+        logger.info(f"File received: {filename}")
         
-        if file.filename == '':
+        if filename == '':
             logger.warning("Empty filename")
             return jsonify({'error': 'No file selected'}), 400
         
-        if not file.filename.endswith('.json'):
-            logger.warning(f"Invalid file type: {file.filename}")
+        if not filename.endswith('.json'):
+            logger.warning(f"Invalid file type: {filename}")
             return jsonify({'error': 'File must be a JSON file'}), 400
         
-        json_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        logger.info(f"Saving file to: {json_path}")
-        file.save(json_path)
-        
-        logger.info("Loading JSON data")
-        data = load_json_data(json_path)
-        character_name = data.get('name', 'character')
-        logger.info(f"Character name: {character_name}")
-        
-        safe_name = secure_filename(character_name) if character_name else 'character'
+        started = time.perf_counter()
+        timings = {} if RENDER_TIMING else None
+        # Before reading the body, so a spike is turned away while it is still cheap
+        try:
+            with timed(timings, 'admit'):
+                reservation = admit_render(render_cost(request.content_length or MAX_UPLOAD_BYTES))
+        except OverBudget as e:
+            metrics.inc('charactercraft_upload_rejected_total', status=503)
+            logger.warning(f"Rejected upload {filename}: {e}")
+            return jsonify({'error': 'Server is busy, please retry shortly'}), 503, {'Retry-After': '2'}
+        return render_admitted(upload, filename, started, timings, reservation)
+    
+    except Exception as e:
+        logger.error(f"Error in upload_file: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+class _ZipStream:
+    """Write-only sink that lets zipfile stream an archive chunk by chunk"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def read_bulk_uploads():
+    """Collect (name, raw bytes) exports from a zip upload and/or a multipart file list"""
+    exports = []
+    for file in request.files.getlist('file') + request.files.getlist('files'):
+        if not file.filename:
+            continue
+        if file.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(file.stream) as archive:
+                for info in archive.infolist():
+                    name = info.filename
+                    if info.is_dir() or not name.endswith('.json') or name.startswith('__MACOSX/'):
+                        continue
+                    if info.file_size > BULK_MAX_FILE_BYTES:
+                        raise ValueError(f"{name} is larger than {BULK_MAX_FILE_BYTES} bytes")
+                    exports.append((name, archive.read(info)))
+                    if len(exports) > BULK_MAX_FILES:
+                        break
+        elif file.filename.endswith('.json'):
+            exports.append((file.filename, file.stream.read()))
+        else:
+            raise ValueError(f"{file.filename} must be a JSON or zip file")
+        if len(exports) > BULK_MAX_FILES:
+            raise ValueError(f"At most {BULK_MAX_FILES} files can be uploaded at once")
+    return exports
+
+@app.route('/upload/bulk', methods=['POST'])
+def bulk_upload():
+    try:
+        logger.info("Bulk upload request received")
+        try:
+            exports = read_bulk_uploads()
+        except (ValueError, zipfile.BadZipFile) as e:
+            logger.warning(f"Rejected bulk upload: {e}")
+            return jsonify({'error': str(e)}), 400
+        if not exports:
+            logger.warning("No JSON files in bulk upload")
+            return jsonify({'error': 'No JSON files provided'}), 400
         
-        output_filename = f"{safe_name}_sheet.html"
-        output_path = os.path.join(OUTPUT_FOLDER, output_filename)
+        logger.info(f"Rendering {len(exports)} files")
+        pool = get_render_pool()
+        futures = {pool.submit(render_upload, raw, name): (name, time.perf_counter()) for name, raw in exports}
         
-        logger.info(f"Generating character sheet: {output_path}")
-        fill_template('character_template.html', data, output_path)
+        def generate():
+            sink = _ZipStream()
+            manifest = []
+            used_names = set()
+            with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for future in as_completed(futures):
+                    name, started = futures[future]
+                    entry = {'input': name}
+                    try:
+                        character_name, output_filename, html, etag, fragments = future.result()
+                        store_sheet(output_filename, html, etag, fragments)
+                        # Two players may both call their character "Talon"
+                        stem, ext = os.path.splitext(output_filename)
+                        archive_name, suffix = output_filename, 2
+                        while archive_name in used_names:
+                            archive_name = f"{stem}-{suffix}{ext}"
+                            suffix += 1
+                        used_names.add(archive_name)
+                        archive.writestr(archive_name, offline_html(html, fragments))
+                        entry.update(status='ok', character_name=character_name,
+                                     output_file=output_filename, archive_name=archive_name)
+                    except Exception as e:
+                        logger.error(f"Error rendering {name}: {e}")
+                        entry.update(status='error', error=str(e))
+                    entry['ms'] = round((time.perf_counter() - started) * 1000, 1)
+                    manifest.append(entry)
+                    yield sink.drain()
+                archive.writestr('manifest.json', json.dumps({
+                    'files': len(manifest),
+                    'succeeded': sum(1 for entry in manifest if entry['status'] == 'ok'),
+                    'results': manifest,
+                }, indent=2))
+            logger.info(f"Bulk upload finished: {len(manifest)} files")
+            yield sink.drain()
         
-        logger.info(f"Successfully generated: {output_filename}")
-        return jsonify({
-            'success': True,
-            'output_file': output_filename,
-            'character_name': character_name
-        })
+        return Response(generate(), mimetype='application/zip',
+                        headers={'Content-Disposition': 'attachment; filename=character_sheets.zip'})
     
     except Exception as e:
-        logger.error(f"Error in upload_file: {str(e)}", exc_info=True)
+        logger.error(f"Error in bulk_upload: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+def stylesheet_css_variants(css, name):
+    """Compressed variants of the linked stylesheet, built once per process"""
+    variants = stylesheet_variants.get(name)
+    if variants is None:
+        variants = stylesheet_variants[name] = compress_variants(css.encode('utf-8'))
+    return variants
+
+@app.route(STYLESHEET_PREFIX + '<filename>')
+def sheet_stylesheet(filename):
+    css, name = template_stylesheet(TEMPLATE_FILE)
+    if filename != name:
+        return jsonify({'error': 'File not found'}), 404
+    
+    variants = stylesheet_css_variants(css, name)
+    encoding = choose_encoding(request.accept_encodings, variants)
+    etag = variant_etag(name, encoding)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(variants[encoding], mimetype='text/css')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    # The name changes whenever the CSS does
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/status/<job_id>')
+def job_status(job_id):
+    try:
+        job = get_render_queue().status(job_id)
+        if job is None:
+            return jsonify({'error': 'Unknown job'}), 404
+        
+        response = {'job_id': job_id, 'status': job['status']}
+        for timing in ('queued_ms', 'render_ms'):
+            if timing in job:
+                response[timing] = job[timing]
+        if job['status'] == 'done':
+            output_filename = job['result']['output_file']
+            response.update(
+                success=True,
+                character_name=job['result']['character_name'],
+                output_file=output_filename,
+                view_url=url_for('view_file', filename=output_filename),
+                download_url=url_for('download_file', filename=output_filename))
+        elif job['status'] == 'failed':
+            response['error'] = job['error']
+        return jsonify(response)
+    except Exception as e:
+        logger.error(f"Error in job_status: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/cache/stats')
+def cache_stats():
+    renders = {'enabled': True, **render_cache.stats()} if render_cache else {'enabled': False}
+    stats = {'renders': renders, 'fragments': fragment_cache.stats()}
+    if render_queue:
+        stats['render_queue'] = render_queue.stats()
+    if render_budget:
+        stats['render_budget'] = render_budget.stats()
+    if sheet_store:
+        stats['storage'] = sheet_store.stats()
+    return jsonify(stats)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    gauges = {}
+    caches = [('fragments', fragment_cache.stats())]
+    if render_cache:
+        caches.append(('renders', render_cache.stats()))
+    for name in ('hits', 'misses', 'evictions', 'hit_ratio', 'entries'):
+        gauges[f'charactercraft_cache_{name}'] = [({'cache': cache}, stats[name]) for cache, stats in caches]
+    if render_queue:
+        queue = render_queue.stats()
+        gauges['charactercraft_render_queue_depth'] = queue['depth']
+        gauges['charactercraft_render_queue_rejected'] = queue['rejected']
+    if render_budget:
+        budget = render_budget.stats()
+        gauges['charactercraft_render_budget_bytes'] = budget['budget_bytes']
+        gauges['charactercraft_render_in_flight_bytes'] = budget['in_flight_bytes']
+        gauges['charactercraft_render_in_flight_peak_bytes'] = budget['peak_bytes']
+        gauges['charactercraft_renders_in_flight'] = budget['in_flight']
+        gauges['charactercraft_renders_waiting'] = budget['waiting']
+        gauges['charactercraft_renders_shed'] = budget['shed']
+    if sheet_store:
+        storage = sheet_store.stats()
+        for name in ('entries', 'bytes', 'evictions', 'deduplicated'):
+            gauges[f'charactercraft_storage_{name}'] = storage[name]
+    gauges['charactercraft_warmup_seconds'] = warmup_stats['seconds']
+    if worker_startup_seconds is not None:
+        gauges['charactercraft_worker_startup_seconds'] = worker_startup_seconds
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
 @app.route('/download/<filename>')
 def download_file(filename):
     try:
@@ -76,6 +888,16 @@ def download_file(filename):
         if not safe_filename:
             return jsonify({'error': 'Invalid filename'}), 400
         
+        variant = request.args.get('variant')
+        if variant:
+            if variant not in SHEET_VARIANTS:
+                return jsonify({'error': 'Invalid variant'}), 400
+            safe_filename = section_filename(safe_filename, variant)
+        
+        sheet = find_sheet(safe_filename)
+        if sheet is not None:
+            return send_sheet(safe_filename, sheet, as_attachment=True)
+        
         file_path = os.path.join(OUTPUT_FOLDER, safe_filename)
         real_path = os.path.realpath(file_path)
         output_dir = os.path.realpath(OUTPUT_FOLDER)
@@ -88,6 +910,7 @@ def download_file(filename):
             logger.warning(f"File not found: {file_path}")
             return jsonify({'error': 'File not found'}), 404
         
+        # Written before the sheet store
         return send_from_directory(OUTPUT_FOLDER, safe_filename, as_attachment=True)
     except Exception as e:
         logger.error(f"Error in download_file: {str(e)}", exc_info=True)
@@ -101,6 +924,16 @@ def view_file(filename):
         if not safe_filename:
             return jsonify({'error': 'Invalid filename'}), 400
         
+        variant = request.args.get('variant')
+        if variant:
+            if variant not in SHEET_VARIANTS:
+                return jsonify({'error': 'Invalid variant'}), 400
+            safe_filename = section_filename(safe_filename, variant)
+        
+        sheet = find_sheet(safe_filename)
+        if sheet is not None:
+            return send_sheet(safe_filename, sheet)
+        
         file_path = os.path.join(OUTPUT_FOLDER, safe_filename)
         real_path = os.path.realpath(file_path)
         output_dir = os.path.realpath(OUTPUT_FOLDER)
@@ -113,10 +946,52 @@ def view_file(filename):
             logger.warning(f"File not found: {file_path}")
             return jsonify({'error': 'File not found'}), 404
         
+        # Written before the sheet store
         return send_from_directory(OUTPUT_FOLDER, safe_filename)
     except Exception as e:
         logger.error(f"Error in view_file: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/view/<filename>/section/<name>')
+def view_section(filename, name):
+    try:
+        logger.info(f"Section request for: {filename} {name}")
+        safe_filename = secure_filename(filename)
+        if not safe_filename or name not in LAZY_SECTIONS:
+            return jsonify({'error': 'Invalid section'}), 400
+        
+        fragment_filename = section_filename(safe_filename, name)
+        sheet = find_sheet(fragment_filename)
+        if sheet is None:
+            logger.warning(f"Section not found: {fragment_filename}")
+            return jsonify({'error': 'File not found'}), 404
+        
+        return send_sheet(fragment_filename, sheet)
+    except Exception as e:
+        logger.error(f"Error in view_section: {str(e)}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+# Exports rendered at startup to seed the fragment cache: files, directories
+# or glob patterns separated by os.pathsep
+WARMUP_EXPORTS = [pattern for pattern in os.environ.get('WARMUP_EXPORTS', '').split(os.pathsep) if pattern]
+
+def warm_up():
+    """Compile templates and fill caches before the first request
+
+    Runs at import, so with gunicorn's preload_app it runs once in the master
+    and every worker starts with the results (see gunicorn.conf.py).
+    """
+    stats = warmup(TEMPLATE_FILE, exports=WARMUP_EXPORTS, variant_templates=SHEET_VARIANTS.values(),
+                   **sheet_render_options())
+    if SHEET_STYLE == 'linked':
+        stylesheet_css_variants(*template_stylesheet(TEMPLATE_FILE))
+    logger.info(f"Warmed up in {stats['seconds'] * 1000:.1f} ms: {stats['exports']} exports rendered "
+                f"({stats['failed']} failed), {stats['fragments']} cached fragments")
+    return stats
+
+warmup_stats = warm_up()
+# Time from fork to serving, set by gunicorn.conf.py in each worker
+worker_startup_seconds = None
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,354 @@
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import generate_character_sheet as sheet
+
+SCHOOLS = ['Abjuration', 'Conjuration', 'Divination', 'Enchantment', 'Evocation',
+           'Illusion', 'Necromancy', 'Transmutation']
+CLASS_NAMES = ['Fighter', 'Wizard', 'Cleric', 'Rogue', 'Paladin', 'Warlock', 'Bard', 'Druid']
+ITEM_TYPES = ['Gear', 'Martial Weapon', 'Simple Weapon', 'Armor', 'Tool', 'Potion', 'Ammunition']
+WORDS = ('the a you your of to and creature action bonus reaction attack damage hit points '
+         'saving throw spell slot level long rest short rest range target ally enemy turn '
+         'round feet within sight radiant fire cold necrotic advantage disadvantage').split()
+
+# Full-caster slot table, used for every generated caster
+SLOTS_PER_LEVEL = {
+    str(level): slots for level, slots in enumerate([
+        [2], [3], [4, 2], [4, 3], [4, 3, 2], [4, 3, 3], [4, 3, 3, 1], [4, 3, 3, 2], [4, 3, 3, 3, 1],
+        [4, 3, 3, 3, 2], [4, 3, 3, 3, 2, 1], [4, 3, 3, 3, 2, 1], [4, 3, 3, 3, 2, 1, 1],
+        [4, 3, 3, 3, 2, 1, 1], [4, 3, 3, 3, 2, 1, 1, 1], [4, 3, 3, 3, 2, 1, 1, 1],
+        [4, 3, 3, 3, 2, 1, 1, 1, 1], [4, 3, 3, 3, 3, 1, 1, 1, 1], [4, 3, 3, 3, 3, 2, 1, 1, 1],
+        [4, 3, 3, 3, 3, 2, 2, 1, 1]], 1)
+}
+
+def _text(rng, words):
+    """Sentence-ish filler text with the occasional line break and a Source: line"""
+    parts = []
+    for i in range(words):
+        parts.append(rng.choice(WORDS))
+        if i % 40 == 39:
+            parts.append('.\n')
+    return ' '.join(parts) + '\n\nSource:\tSystem Reference Document v5.2'
+
+def _feature(rng, name, feature_type, words=60):
+    feature = {
+        'id': f"{name}_{feature_type}",
+        'name': name,
+        'description': _text(rng, words),
+        'type': feature_type,
+        'prerequisiteList': [],
+        'customResource': '0',
+    }
+    if rng.random() < 0.3:
+        feature['customFields'] = {name: {'scaling': {
+            'type': rng.choice(['proficiency', 'attribute', 'level']),
+            'attribute': rng.choice(sheet.ABILITIES), 'baseValue': rng.randint(0, 2)}}}
+    return feature
+
+def _item(rng, number, contained, depth):
+    item_type = rng.choice(ITEM_TYPES)
+    item = {
+        'id': f"item_{depth}_{number}",
+        'title': f"{item_type} {number}",
+        'description': _text(rng, 30),
+        'properties': 'Finesse, Light' if 'Weapon' in item_type else '',
+        'equipped': rng.random() < 0.3,
+        'quantity': rng.randint(1, 20),
+        'weight': round(rng.uniform(0, 10), 1),
+        'type': item_type,
+        'hitBonus': rng.randint(0, 3),
+        'damages': {'Slashing': '1d8'} if 'Weapon' in item_type else {},
+        'price': f"{rng.randint(1, 500)} gp",
+    }
+    # Containers hold their own items, one level deep below the top level
+    if depth < 2 and contained and item_type == 'Gear':
+        item['containedItems'] = [_item(rng, n, contained, depth + 1) for n in range(contained)]
+    return item
+
+def _note(rng, number, size):
+    words = max(1, size // 7)
+    text = _text(rng, words)
+    if number % 2:
+        # Quill delta, the way the CharacterCraft editor saves rich notes
+        content = json.dumps([{'insert': line + '\n'} for line in text.split('\n')], separators=(',', ':'))
+    else:
+        content = text
+    return {'title': f"Note {number}", 'content': content}
+
+def generate_character(seed=0, classes=2, spells=40, equipment=40, contained=3, features=30,
+                       notes=4, note_kb=4):
+    """Deterministic synthetic CharacterCraft export of the given size"""
+    rng = random.Random(seed)
+    class_list = []
+    for number in range(max(1, classes)):
+        name = CLASS_NAMES[number % len(CLASS_NAMES)]
+        class_list.append({
+            'id': f"{name}_{number}",
+            'name': name,
+            'description': _text(rng, 300),
+            'level': rng.randint(1, 20),
+            'hitPointDie': rng.choice(['D6', 'D8', 'D10', 'D12']),
+            'armorTraining': 'Light and Medium armor and Shields',
+            'spellAbility': rng.choice(['Intelligence', 'Wisdom', 'Charisma']) if number % 2 == 0 else '',
+            'classFeatures': {
+                str(level): [_feature(rng, f"Level {level}: {name} Feature", f"{name} Class Feature")]
+                for level in range(1, 21)
+            },
+            'subClasses': {'3': [{'name': f"{name} Path", 'description': _text(rng, 200)}]},
+        })
+
+    feature_list = [_feature(rng, f"Feature {number}", f"{rng.choice(class_list)['name']} Class Feature")
+                    for number in range(features)]
+    for class_info in class_list:
+        if class_info['spellAbility']:
+            slots = _feature(rng, f"Spellcasting ({class_info['name']})", f"{class_info['name']} Class Feature")
+            slots['spellSlotsPerLevel'] = SLOTS_PER_LEVEL
+            feature_list.append(slots)
+
+    spell_list = []
+    for number in range(spells):
+        level = rng.randint(0, 9)
+        spell_list.append({
+            'id': f"spell_{number}",
+            'title': f"Spell {number}",
+            'level': level,
+            'school': 'Invocation' if number % 17 == 16 else rng.choice(SCHOOLS),
+            'castingTime': rng.choice(['Action', 'Bonus Action', 'Reaction', '1 minute']),
+            'range': f"{rng.choice([5, 30, 60, 120])} feet",
+            'duration': rng.choice(['Instantaneous', 'Concentration, up to 1 minute', '1 hour']),
+            'description': _text(rng, rng.randint(40, 250)),
+            'atHigherLevels': _text(rng, 20),
+            'preparingClass': rng.choice(class_list)['name'],
+            'prepared': rng.random() < 0.6,
+        })
+
+    return {
+        'id': f"synthetic-{seed}",
+        'lastModified': '2025-01-01T00:00:00Z',
+        'name': f"Synthetic {seed}",
+        'alignment': 'True Neutral',
+        'maxHP': rng.randint(8, 200),
+        'armorClass': rng.randint(10, 20),
+        'speed': '30 ft.',
+        'proficiencyBonus': rng.randint(2, 6),
+        'attributes': {ability: rng.randint(8, 20) for ability in sheet.ABILITIES},
+        'skillProficiencies': {skill: rng.random() < 0.3
+                               for skills in sheet.SKILLS_BY_ABILITY.values() for skill in skills},
+        'skillExpertise': {},
+        'languages': ['Common', 'Elvish'],
+        'weaponProficiencies': ['Simple weapons', 'Martial weapons'],
+        'toolProficiencies': ["Thieves' Tools"],
+        'background': {'name': 'Sage', 'description': _text(rng, 100)},
+        'species': {
+            'name': 'Dragonborn', 'description': _text(rng, 80), 'size': 'Medium', 'speed': '30 ft.',
+            'traits': [_feature(rng, 'Breath Weapon', 'Species Trait'),
+                       _feature(rng, 'Darkvision', 'Species Trait')],
+        },
+        'class': class_list,
+        'featuresAndTraits': feature_list,
+        'feats': [_feature(rng, f"Feat {number}", 'Feat') for number in range(max(1, features // 10))],
+        'spells': spell_list,
+        'equipment': [_item(rng, number, contained, 0) for number in range(equipment)],
+        'notes': [_note(rng, number, note_kb * 1024) for number in range(notes)],
+        'archivedNotes': [_note(rng, number, note_kb * 1024) for number in range(notes)],
+        'bio': _text(rng, 120),
+    }
+
+def _median_ms(fn, repeat, before=None):
+    """Median wall time of fn() over repeat runs, in ms; before() runs untimed first"""
+    times = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 3)
+
+def _peak_kb(fn):
+    """Peak traced Python allocation while running fn(), in KB"""
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+def _cold():
+    """Forget cached fragments and sections, so every run renders from scratch"""
+    sheet.fragment_cache.clear()
+    sheet.section_history.clear()
+    sheet.slot_tables.clear()
+
+def run_benchmarks(data, repeat=5, template_file='character_template.html', flask=True):
+    """Time loading, each extractor, the full render and the /upload route for one export"""
+    raw = json.dumps(data).encode('utf-8')
+    timings = {}
+    memory = {}
+    first_class = (sheet._dicts(data.get('class')) or [{}])[0]
+    features = data.get('featuresAndTraits', [])
+    equipment = data.get('equipment', [])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = os.path.join(tmp, 'character.json')
+        output_file = os.path.join(tmp, 'character.html')
+        with open(json_file, 'wb') as f:
+            f.write(raw)
+
+        timings['load_json_data'] = _median_ms(lambda: sheet.load_json_data(json_file), repeat)
+        timings['load_json_data[selective]'] = _median_ms(lambda: sheet.load_json_data(json_file, True), repeat)
+        memory['load_json_data'] = _peak_kb(lambda: sheet.load_json_data(json_file))
+        memory['load_json_data[selective]'] = _peak_kb(lambda: sheet.load_json_data(json_file, True))
+
+        extractors = {
+            'CharacterIndex': lambda: sheet.CharacterIndex(data),
+            'extract_features': lambda: sheet.extract_features(features),
+            'extract_class_features': lambda: sheet.extract_class_features(first_class),
+            'extract_spells': lambda: sheet.extract_spells(data.get('spells', [])),
+            'extract_weapons': lambda: sheet.extract_weapons(equipment, data.get('proficiencyBonus', 2)),
+            'extract_inventory': lambda: sheet.extract_inventory(equipment),
+            'extract_actions': lambda: sheet.extract_actions(data),
+            'extract_spell_slots': lambda: sheet.extract_spell_slots(first_class, features),
+            'extract_spell_slots[full index]': lambda: sheet.extract_spell_slots(
+                first_class, features, sheet.CharacterIndex(data)),
+        }
+        for name, fn in extractors.items():
+            timings[name] = _median_ms(fn, repeat, _cold)
+
+        sheet.load_template(template_file)
+        timings['fill_template'] = _median_ms(
+            lambda: sheet.fill_template(template_file, data, output_file), repeat, _cold)
+        timings['fill_template[warm]'] = _median_ms(
+            lambda: sheet.fill_template(template_file, data, output_file), repeat)
+        _cold()
+        memory['fill_template'] = _peak_kb(lambda: sheet.fill_template(template_file, data, output_file))
+        plan = [template_file, 'print_template.html', 'summary_template.html']
+        timings['render_plan[3 templates]'] = _median_ms(lambda: sheet.render_plan(data, plan), repeat, _cold)
+
+    if flask:
+        client = _flask_client()
+
+        def upload():
+            response = client.post('/upload', data={'file': (io.BytesIO(raw), 'character.json')})
+            if response.status_code != 200:
+                raise RuntimeError(f"/upload returned {response.status_code}: {response.get_data(as_text=True)}")
+
+        timings['POST /upload'] = _median_ms(upload, repeat, _cold)
+
+    return {
+        'input_bytes': len(raw),
+        'timings_ms': timings,
+        'peak_memory_kb': memory,
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def _flask_client():
+    """Test client for app.py that renders every upload in memory, without the render cache"""
+    os.environ.setdefault('RENDER_CACHE_PATH', '')
+    os.environ.setdefault('UPLOAD_MODE', 'memory')
+    import app
+    logging.getLogger('app').setLevel(logging.WARNING)
+    return app.app.test_client()
+
+def compare(results, baseline, threshold=0.25, floor_ms=0.2):
+    """List of regressions of results against baseline
+
+    A timing regresses when it is more than threshold slower and by more than
+    floor_ms, so sub-millisecond noise does not fail the run; peak memory
+    regresses when it grows by more than threshold.
+    """
+    regressions = []
+    for name, base in baseline.get('timings_ms', {}).items():
+        current = results['timings_ms'].get(name)
+        if current is not None and current > base * (1 + threshold) and current - base > floor_ms:
+            regressions.append(f"{name}: {base:.3f} ms -> {current:.3f} ms (+{(current / base - 1) * 100:.0f}%)")
+    for name, base in baseline.get('peak_memory_kb', {}).items():
+        current = results['peak_memory_kb'].get(name)
+        if current is not None and base and current > base * (1 + threshold):
+            regressions.append(f"{name}: {base:.0f} KB -> {current:.0f} KB peak (+{(current / base - 1) * 100:.0f}%)")
+    return regressions
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(
+        description='Time character sheet rendering on a synthetic (or real) export.')
+    parser.add_argument('--seed', type=int, default=0, help='Generator seed')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply every generated count by this')
+    parser.add_argument('--classes', type=int, default=2, help='Classes')
+    parser.add_argument('--spells', type=int, default=40, help='Spells')
+    parser.add_argument('--equipment', type=int, default=40, help='Top-level equipment items')
+    parser.add_argument('--contained', type=int, default=3, help='containedItems per container')
+    parser.add_argument('--features', type=int, default=30, help='featuresAndTraits entries')
+    parser.add_argument('--notes', type=int, default=4, help='Notes (and as many archived notes)')
+    parser.add_argument('--note-kb', type=int, default=4, help='Size of each note in KB')
+    parser.add_argument('--input', help='Benchmark this export instead of a generated one')
+    parser.add_argument('--dump', help='Write the generated export here and exit')
+    parser.add_argument('-r', '--repeat', type=int, default=7, help='Runs per measurement (median is kept)')
+    parser.add_argument('-t', '--template', default='character_template.html', help='Template file')
+    parser.add_argument('--no-flask', action='store_true', help='Skip the POST /upload measurement')
+    parser.add_argument('--json', help='Write the results here')
+    parser.add_argument('--baseline', help='Fail if results regress against this results file')
+    parser.add_argument('--save-baseline', help='Write the results here as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Allowed slowdown, 0.25 = 25%%')
+    args = parser.parse_args(argv)
+
+    params = {
+        name: max(1 if name == 'classes' else 0, round(getattr(args, name) * args.scale))
+        for name in ('classes', 'spells', 'equipment', 'contained', 'features', 'notes', 'note_kb')
+    }
+    params['seed'] = args.seed
+    if args.input:
+        data = sheet.load_json_data(args.input)
+        params = {'input': args.input}
+    else:
+        data = generate_character(**params)
+
+    if args.dump:
+        with open(args.dump, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        print(f"Wrote {args.dump}")
+        return 0
+
+    results = run_benchmarks(data, args.repeat, args.template, not args.no_flask)
+    results['params'] = params
+    results['python'] = platform.python_version()
+
+    print(f"Input: {results['input_bytes'] / 1024:.0f} KB {json.dumps(params)}")
+    for name, ms in results['timings_ms'].items():
+        print(f"    {ms:10.3f} ms  {name}")
+    for name, kb in results['peak_memory_kb'].items():
+        print(f"    {kb:10.0f} KB  peak {name}")
+    print(f"    {results['max_rss_kb']:10d} KB  max RSS")
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print(f"Warning: baseline was measured on {json.dumps(baseline.get('params'))}")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.threshold * 100:.0f}%:")
+            for line in regressions:
+                print(f"    {line}")
+            return 1
+        print(f"\nNo regressions beyond {args.threshold * 100:.0f}% against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,17 @@
+import codecs
+import glob
+import hashlib
 import json
+import marshal
+import os
+import re
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from html import escape
 from string import Template
 
 # HTML Templates
@@ -8,25 +21,849 @@ WEAPON_ITEM = Template('<div class="feature-item"><strong>$name</strong><div cla
 INVENTORY_ITEM = Template('<div class="feature-item"><strong>$name$status</strong><div class="feature-text"><em>Type:</em> $type, <em>Quantity:</em> $quantity, <em>Weight:</em> $weight lbs</div></div>')
 ABILITY_GROUP = Template('<div class="ability-group"><div class="abilities-skills-layout"><div class="stat"><label>$short_name</label><div class="stat-value">$score</div><div class="stat-mod">$modifier</div></div><div class="skills-box">$skills</div></div></div>')
 SKILL_ITEM = Template('<div class="skill-item"><span class="skill-name">$name</span>$prof_indicator<span class="skill-bonus">$bonus</span></div>')
+LAZY_SECTION = Template('<details class="lazy-section" data-src="$url" ontoggle="if(this.open&&!this.dataset.loaded){this.dataset.loaded=1;fetch(this.dataset.src).then(r=>r.text()).then(h=>this.insertAdjacentHTML(\'beforeend\',h))}"><summary>$label</summary></details>')
+
+# Fields of a CharacterCraft export that render_sheet actually reads. A value of
+# True keeps the field whole, a dict keeps only the listed keys of an object and
+# a one-element list applies its spec to every item of an array. The selective
+# loader drops everything else (classFeatures, subClasses, ...).
+_FEATURE_FIELDS = {
+    'name': True, 'description': True, 'text': True, 'type': True,
+    'customFields': True, 'customResource': True, 'spellSlotsPerLevel': True,
+}
+RENDER_FIELDS = {
+    'id': True, 'lastModified': True, 'name': True, 'alignment': True,
+    'maxHP': True, 'currentHP': True, 'armorClass': True, 'speed': True,
+    'proficiencyBonus': True, 'abilityScores': True, 'attributes': True,
+    'skillProficiencies': True, 'skillExpertise': True,
+    'languages': True, 'weaponProficiencies': True, 'toolProficiencies': True,
+    'notes': True, 'archivedNotes': True, 'bio': True, 'age': True, 'height': True, 'weight': True,
+    'eyes': True, 'hair': True, 'skin': True,
+    'background': {'name': True},
+    'class': [{
+        'name': True, 'level': True, 'hitPointDie': True,
+        'armorTraining': True, 'spellAbility': True,
+    }],
+    'species': {
+        'name': True, 'description': True, 'size': True, 'speed': True,
+        'traits': [_FEATURE_FIELDS],
+    },
+    'featuresAndTraits': [_FEATURE_FIELDS],
+    'feats': [_FEATURE_FIELDS],
+    'spells': [{
+        'title': True, 'school': True, 'level': True, 'preparingClass': True,
+        'castingTime': True, 'range': True, 'duration': True, 'description': True,
+    }],
+    'equipment': [{
+        'title': True, 'type': True, 'equipped': True, 'quantity': True,
+        'weight': True, 'hitBonus': True, 'damages': True, 'properties': True,
+    }],
+}
+
+@contextmanager
+def timed(timings, name):
+    """Add the time spent in the block to timings[name] (seconds); a no-op when timings is None"""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+# Compiled once at import, so workers forked from a preloaded app share them
+_SOURCE_LINE = re.compile(r'(Source:.*?)(?=<br>|$)', re.DOTALL)
+_USES_PHRASE = re.compile(r'use this feature (once|twice|thrice|\d+ times?)', re.IGNORECASE)
+_DIGITS = re.compile(r'\d+')
+_RECHARGE = re.compile(r'Short Rest|Long Rest')
+_QUILL_DELIMITER = re.compile(r'[\s,]*')
+_SAFE_LINK = re.compile(r'(https?:|mailto:|/|#)', re.IGNORECASE)
+
+# Characters of text rendered per note before it is cut short, and whether
+# archivedNotes are rendered collapsed, shown like notes or left out
+NOTE_MAX_CHARS = int(os.environ.get('NOTE_MAX_CHARS', '20000'))
+ARCHIVED_NOTES = os.environ.get('ARCHIVED_NOTES', 'collapse')
 
 def style_source_text(text):
     """Style Source: text to be lighter and italic"""
-    import re
-    return re.sub(r'(Source:.*?)(?=<br>|$)', r'<span style="color: #888; font-style: italic;">\1</span>', text, flags=re.DOTALL)
+    return _SOURCE_LINE.sub(r'<span style="color: #888; font-style: italic;">\1</span>', text)
+
+class FragmentCache:
+    """Bounded LRU of rendered HTML fragments shared by every render in the process"""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_render(self, key, render):
+        """Return the fragment cached under key, calling render() on a miss"""
+        try:
+            with self._lock:
+                html = self._entries.get(key)
+                if html is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return html
+                self.misses += 1
+        except TypeError:
+            # Unhashable field values (malformed exports) just skip the cache
+            return render()
+        
+        html = render()
+        self.put(key, html)
+        return html
+
+    def get(self, key):
+        """Return the value cached under key, or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store value under key, evicting the least recently used entries"""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Hit/miss/eviction counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+    def clear(self):
+        """Drop every fragment and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+# Most descriptions are identical SRD text shared by many characters, so the
+# formatted fragment is keyed on the raw fields it is rendered from
+fragment_cache = FragmentCache(int(os.environ.get('FRAGMENT_CACHE_SIZE', '4096')))
+
+def format_feature_item(name, description):
+    """FEATURE_ITEM for a raw description, with line breaks and Source: styling"""
+    return fragment_cache.get_or_render(
+        ('feature', name, description),
+        lambda: FEATURE_ITEM.substitute(name=name, description=style_source_text(description.replace('\n', '<br>'))))
+
+def format_spell_item(name, school, casting_time, range_val, duration, description):
+    """SPELL_ITEM for a raw spell description, with line breaks and Source: styling"""
+    return fragment_cache.get_or_render(
+        ('spell', name, school, casting_time, range_val, duration, description),
+        lambda: SPELL_ITEM.substitute(
+            name=name, school=school, casting_time=casting_time, range=range_val,
+            duration=duration, description=style_source_text(description.replace('\n', '<br>'))))
+
+class CompiledTemplate:
+    """Page template pre-split into literal text and placeholder segments"""
+
+    def __init__(self, template_content, version=''):
+        self.version = version
+        # Each segment is (placeholder_name, text): literals have no name,
+        # placeholders keep their raw text so unknown keys render unchanged
+        # exactly like Template.safe_substitute does.
+        segments = []
+        literal = []
+        pos = 0
+        for match in Template.pattern.finditer(template_content):
+            literal.append(template_content[pos:match.start()])
+            pos = match.end()
+            name = match.group('named') or match.group('braced')
+            if name is not None:
+                segments.append((None, ''.join(literal)))
+                literal = []
+                segments.append((name, match.group()))
+            elif match.group('escaped') is not None:
+                literal.append(Template.delimiter)
+            else:
+                literal.append(match.group())
+        literal.append(template_content[pos:])
+        segments.append((None, ''.join(literal)))
+        self.segments = [(name, text) for name, text in segments if name or text]
+        self.placeholders = frozenset(name for name, _ in self.segments if name)
+
+    def render(self, mapping):
+        """Join the segments, substituting placeholders found in mapping"""
+        parts = []
+        for name, text in self.segments:
+            if name is None:
+                parts.append(text)
+            elif name in mapping:
+                parts.append(str(mapping[name]))
+            else:
+                parts.append(text)
+        return ''.join(parts)
+
+# Compiled templates keyed on (absolute path, stylesheet_url, minify),
+# invalidated by mtime/size changes
+_template_registry = {}
+
+_STYLE_BLOCK = re.compile(r'<style>(.*?)</style>', re.DOTALL)
+_CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+_CSS_SPACE = re.compile(r'\s*([{};,>])\s*|(:)\s+')
+_HTML_COMMENT = re.compile(r'<!--.*?-->', re.DOTALL)
+_TAG_GAP = re.compile(r'>\s*\n\s*<')
+
+def minify_css(css):
+    """Drop comments and the whitespace CSS does not need"""
+    css = ' '.join(_CSS_COMMENT.sub('', css).split())
+    css = _CSS_SPACE.sub(lambda m: m.group(1) or m.group(2), css)
+    return css.replace(';}', '}')
+
+def minify_html(html):
+    """Collapse indentation between tags to a single newline
+
+    A newline renders the same as the run it replaces, including inline
+    elements, so only the bytes change.
+    """
+    return _TAG_GAP.sub('>\n<', html)
+
+def _template_variant(template_content, stylesheet_url, minify):
+    """Apply the linked-stylesheet and minified output modes to template source"""
+    if stylesheet_url:
+        link = f'<link rel="stylesheet" href="{stylesheet_url.replace("$", "$$")}">'
+        template_content = _STYLE_BLOCK.sub(lambda m: link, template_content, count=1)
+    elif minify:
+        template_content = _STYLE_BLOCK.sub(lambda m: f'<style>{minify_css(m.group(1))}</style>',
+                                            template_content, count=1)
+    if minify:
+        template_content = minify_html(_HTML_COMMENT.sub('', template_content))
+    return template_content
+
+def _renderer_fingerprint():
+    """Hash of this module's source and note settings, so cached renders expire when either changes"""
+    try:
+        with open(__file__, 'rb') as f:
+            return hashlib.sha256(f.read() + f"{NOTE_MAX_CHARS}:{ARCHIVED_NOTES}".encode()).hexdigest()
+    except OSError:
+        return ''
+
+RENDERER_FINGERPRINT = _renderer_fingerprint()
+
+def load_template(template_file, stylesheet_url=None, minify=False):
+    """Load and compile a template once, recompiling only when the file changes
+    
+    stylesheet_url replaces the template's <style> block with a link to that
+    URL (see template_stylesheet); minify strips comments and indentation.
+    """
+    path = os.path.abspath(template_file)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Template file not found: {template_file}")
+    version = (stat.st_mtime_ns, stat.st_size)
+    
+    key = (path, stylesheet_url or None, bool(minify))
+    cached = _template_registry.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            template_content = f.read()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Template file not found: {template_file}")
+    except Exception as e:
+        raise Exception(f"Error reading template file: {e}")
+    
+    style = _STYLE_BLOCK.search(template_content)
+    stylesheet = minify_css(style.group(1)) if style else ''
+    template_content = _template_variant(template_content, stylesheet_url, minify)
+    digest = hashlib.sha256(RENDERER_FINGERPRINT.encode() + template_content.encode('utf-8'))
+    compiled = CompiledTemplate(template_content, digest.hexdigest()[:16])
+    compiled.stylesheet = stylesheet
+    compiled.minify = bool(minify)
+    _template_registry[key] = (version, compiled)
+    return compiled
+
+def template_version(template_file, stylesheet_url=None, minify=False):
+    """Version string that changes whenever the template, renderer or output mode changes"""
+    return load_template(template_file, stylesheet_url, minify).version
+
+def template_stylesheet(template_file):
+    """(css, file_name) for the template's <style> block as a standalone stylesheet
+
+    The file name carries a hash of the CSS, so it can be cached forever.
+    """
+    css = load_template(template_file).stylesheet
+    return css, f"sheet.{hashlib.sha256(css.encode('utf-8')).hexdigest()[:12]}.css"
 
-def load_json_data(json_file):
+def load_json_data(json_file, selective=False):
     """Load JSON data from file with error handling"""
     try:
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # Validate that we have the minimum required fields
-            if not isinstance(data, dict):
-                raise ValueError("JSON data must be an object")
-            return data
+        with open(json_file, 'rb') as f:
+            return load_json_stream(f, selective)
     except FileNotFoundError:
         raise FileNotFoundError(f"JSON file not found: {json_file}")
-    except json.JSONDecodeError as e:
+
+def load_json_stream(stream, selective=False):
+    """Load JSON data from an open file-like object (e.g. an upload stream)
+    
+    With selective=True only the fields listed in RENDER_FIELDS are kept.
+    """
+    try:
+        if selective:
+            text = stream.read()
+            if isinstance(text, bytes):
+                text = text.decode(json.detect_encoding(text))
+            data = _load_selective(text, RENDER_FIELDS)
+        else:
+            data = json.load(stream)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
         raise ValueError(f"Invalid JSON format: {e}")
+    # Validate that we have the minimum required fields
+    if not isinstance(data, dict):
+        raise ValueError("JSON data must be an object")
+    return data
+
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_json_decoder = json.JSONDecoder()
+
+def _project(value, spec):
+    """Keep only the parts of a decoded value named by spec"""
+    if spec is True:
+        return value
+    if isinstance(spec, dict) and isinstance(value, dict):
+        return {key: _project(item, spec[key]) for key, item in value.items() if key in spec}
+    if isinstance(spec, list) and isinstance(value, list):
+        return [_project(item, spec[0]) for item in value]
+    # Unknown shape - keep the value whole rather than guess
+    return value
+
+def _load_selective(text, manifest):
+    """Decode a top-level object one member (or array item) at a time
+    
+    Members outside the manifest are decoded and dropped straight away and
+    array members are projected item by item, so the full export tree is never
+    alive at once. Anything unexpected falls back to a full json.loads, which
+    also produces the usual error messages for invalid documents.
+    """
+    ws = _JSON_WHITESPACE.match
+    raw_decode = _json_decoder.raw_decode
+    scanstring = json.decoder.scanstring
+    data = {}
+    try:
+        i = ws(text, 0).end()
+        if text[i] != '{':
+            raise ValueError("not an object")
+        i = ws(text, i + 1).end()
+        while text[i] != '}':
+            if text[i] != '"':
+                raise ValueError("expected key")
+            key, i = scanstring(text, i + 1)
+            i = ws(text, i).end()
+            if text[i] != ':':
+                raise ValueError("expected ':'")
+            i = ws(text, i + 1).end()
+            
+            spec = manifest.get(key)
+            if isinstance(spec, list) and text[i] == '[':
+                items = []
+                i = ws(text, i + 1).end()
+                while text[i] != ']':
+                    item, i = raw_decode(text, i)
+                    items.append(_project(item, spec[0]))
+                    i = ws(text, i).end()
+                    if text[i] == ',':
+                        i = ws(text, i + 1).end()
+                        if text[i] == ']':
+                            raise ValueError("trailing ','")
+                    elif text[i] != ']':
+                        raise ValueError("expected ',' or ']'")
+                data[key] = items
+                i += 1
+            else:
+                value, i = raw_decode(text, i)
+                if spec is not None:
+                    data[key] = _project(value, spec)
+            
+            i = ws(text, i).end()
+            if text[i] == ',':
+                i = ws(text, i + 1).end()
+                if text[i] == '}':
+                    raise ValueError("trailing ','")
+            elif text[i] != '}':
+                raise ValueError("expected ',' or '}'")
+        i += 1
+        if ws(text, i).end() != len(text):
+            raise ValueError("trailing data")
+    except (ValueError, IndexError):
+        data = None
+    return json.loads(text) if data is None else data
+
+def _truncated(error, text):
+    """Whether a JSONDecodeError at the end of a partial document could be cured by more input"""
+    # Strings report where they started; literals, escapes and delimiters fail within a few characters of the end
+    return error.msg.startswith('Unterminated string') or len(text) - error.pos < 10
+
+def load_json_chunks(chunks, selective=False, check=None, keep=True):
+    """Load a JSON object from an iterable of byte chunks, one top-level member at a time
+
+    Parsing keeps pace with the chunks, so a document that is not an object,
+    is malformed, or has a member that check(key, value) rejects raises
+    ValueError without the rest of chunks being read. With selective=True only
+    the fields listed in RENDER_FIELDS are kept; with keep=False every member
+    is dropped once checked and {} is returned, which validates the document
+    without building its tree.
+    """
+    ws = _JSON_WHITESPACE.match
+    raw_decode = _json_decoder.raw_decode
+    scanstring = json.decoder.scanstring
+    chunks = iter(chunks)
+    data = {}
+    decoder = None
+    head = b''
+    text = ''
+    i = 0
+    # Characters dropped from the front of text, for error positions
+    offset = 0
+    # 'start', 'key', 'first_key', 'colon', 'value', 'comma' or 'end'
+    state = 'start'
+    key = None
+    # Don't retry an unfinished value until text has grown past this
+    retry_at = 0
+    eof = False
+
+    def fail(message, pos):
+        raise ValueError(f"Invalid JSON format: {message} (char {offset + pos})")
+
+    while True:
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            chunk = b''
+        if decoder is None:
+            # Like json.load, pick UTF-8/16/32 from the first bytes
+            head += chunk
+            if len(head) < 4 and not eof:
+                continue
+            decoder = codecs.getincrementaldecoder(json.detect_encoding(head))()
+            chunk = head
+        try:
+            text += decoder.decode(chunk, final=eof)
+        except UnicodeDecodeError as e:
+            raise ValueError(f"Invalid JSON format: {e}")
+        if not eof and len(text) < retry_at:
+            continue
+
+        while True:
+            i = ws(text, i).end()
+            if i == len(text):
+                break
+            if state == 'start':
+                if text[i] != '{':
+                    raise ValueError("JSON data must be an object")
+                i += 1
+                state = 'first_key'
+            elif state in ('key', 'first_key'):
+                if text[i] == '}' and state == 'first_key':
+                    i += 1
+                    state = 'end'
+                    continue
+                if text[i] != '"':
+                    fail("Expecting property name enclosed in double quotes", i)
+                try:
+                    key, end = scanstring(text, i + 1)
+                except json.JSONDecodeError as e:
+                    if eof or not _truncated(e, text):
+                        fail(e.msg, e.pos)
+                    break
+                i = end
+                state = 'colon'
+            elif state == 'colon':
+                if text[i] != ':':
+                    fail("Expecting ':' delimiter", i)
+                i += 1
+                state = 'value'
+            elif state == 'value':
+                try:
+                    value, end = raw_decode(text, i)
+                except json.JSONDecodeError as e:
+                    if eof or not _truncated(e, text):
+                        fail(e.msg, e.pos)
+                    # Wait for the buffered value to double so long members parse in linear time
+                    retry_at = i + 2 * (len(text) - i)
+                    break
+                if not eof and (end == len(text) or isinstance(value, (int, float))
+                                and not text[end:].strip('0123456789+-.eE')):
+                    # A number may continue in the next chunk ('1' of '1e5')
+                    break
+                if check:
+                    check(key, value)
+                spec = (RENDER_FIELDS.get(key) if selective else True) if keep else None
+                if spec is not None:
+                    data[key] = _project(value, spec)
+                i = end
+                state = 'comma'
+            elif state == 'comma':
+                if text[i] == ',':
+                    state = 'key'
+                elif text[i] == '}':
+                    state = 'end'
+                else:
+                    fail("Expecting ',' delimiter", i)
+                i += 1
+            else:
+                fail("Extra data", i)
+
+        if eof:
+            if state != 'end':
+                fail("Unexpected end of data", len(text))
+            return data
+        # Drop what has been parsed so text only holds the unfinished member
+        offset += i
+        text = text[i:]
+        retry_at -= i
+        i = 0
+
+def check_export_member(key, value):
+    """Reject a top-level export member that would crash the render or has the wrong type
+    
+    Shapes the renderer already tolerates, such as stray non-object class
+    entries or an odd 'attributes' next to 'abilityScores', are let through.
+    """
+    if key == 'name' and value is not None and not isinstance(value, str):
+        raise ValueError("'name' must be a string")
+    if key == 'class' and not isinstance(value, (dict, list)):
+        raise ValueError("'class' must be an object or a list")
+    # 'attributes' is only read when 'abilityScores' is missing, and any
+    # non-object there counts as all 10s, so it is never rejected
+    if key == 'abilityScores' and value is not None and not isinstance(value, dict):
+        raise ValueError("'abilityScores' must be an object")
+
+_ATTACK_WORD = re.compile(r'\battack\b')
+
+def _dicts(items):
+    """The dict entries of a JSON array, or [] for anything that isn't an array"""
+    return [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+
+def _group(groups, key, item):
+    """Append item to groups[key], skipping unhashable keys from malformed exports"""
+    try:
+        groups.setdefault(key, []).append(item)
+    except TypeError:
+        pass
+
+def _is_action_feature(feature):
+    """Whether a class feature or feat describes something used as an action"""
+    desc_lower = feature.get('description', '').lower()
+    # 'bonus action' and 'reaction' both contain 'action'
+    return 'action' in desc_lower or _ATTACK_WORD.search(desc_lower) is not None
+
+def _is_action_trait(trait):
+    """Whether a species trait is something used as an action"""
+    return 'breath' in trait.get('name', '').lower() or 'action' in trait.get('description', '').lower()
+
+def _levels(mapping):
+    """(level, value) pairs of a {"<level>": value} export mapping in level order, skipping non-numeric keys"""
+    pairs = []
+    if isinstance(mapping, dict):
+        for key, value in mapping.items():
+            try:
+                pairs.append((int(key), value))
+            except (ValueError, TypeError):
+                continue
+    pairs.sort(key=lambda pair: pair[0])
+    return pairs
+
+def _level(value):
+    """Class level from the export as an int, 1 when missing or malformed"""
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return 1
+
+class SlotTable:
+    """Spell slots by level from a spellSlotsPerLevel mapping; a level between rows gets the row below it"""
+
+    def __init__(self, slots_per_level):
+        rows = [(level, slots) for level, slots in _levels(slots_per_level) if isinstance(slots, list)]
+        self.levels = [level for level, _ in rows]
+        self.rows = [slots for _, slots in rows]
+
+    def at(self, level):
+        """Slots per spell level at a class level, [] below the first row"""
+        i = bisect_right(self.levels, level)
+        return self.rows[i - 1] if i else []
+
+# Slot progressions are the same SRD tables in most exports, so parsed tables
+# are shared across renders, keyed on the mapping they were built from
+slot_tables = FragmentCache(int(os.environ.get('SLOT_TABLE_CACHE_SIZE', '256')))
+
+def slot_table(slots_per_level):
+    """SlotTable for a spellSlotsPerLevel mapping, shared by every export with the same one"""
+    try:
+        key = hashlib.sha256(marshal.dumps(slots_per_level)).digest()
+    except ValueError:
+        return SlotTable(slots_per_level)
+    return slot_tables.get_or_render(key, lambda: SlotTable(slots_per_level))
+
+def _selected_subclass(class_info):
+    """The subClasses entry named by the class's selectedSubclassId, or {}"""
+    subclass_id = class_info.get('selectedSubclassId')
+    subclasses = class_info.get('subClasses')
+    if subclass_id and isinstance(subclasses, dict):
+        for options in subclasses.values():
+            for subclass in _dicts(options):
+                if subclass.get('subClassId') == subclass_id:
+                    return subclass
+    return {}
+
+def _class_slots(class_name, slot_features):
+    """spellSlotsPerLevel of the first slot feature whose type names the class, or {}"""
+    bare_name = class_name.replace(' [2024]', '')
+    for feature in slot_features:
+        feature_type = feature.get('type', '')
+        if isinstance(feature_type, str) and (bare_name in feature_type or class_name in feature_type):
+            slots_per_level = feature.get('spellSlotsPerLevel')
+            if slots_per_level:
+                return slots_per_level
+    return {}
+
+class ClassTable:
+    """One class's features and spell slots indexed by level, for bisect lookups
+    
+    levels is sorted and ends[i] counts the features gained by levels[i], so
+    the features up to a level are a bisect and a slice of features. Those of
+    the selected subclass are merged in at the levels they are gained. The
+    feature index is built on first use, since spellcasting only needs slots.
+    """
+
+    def __init__(self, class_info, slot_features=()):
+        self.class_info = class_info
+        self.levels = None
+        class_name = class_info.get('name', '')
+        self.slots = slot_table(_class_slots(class_name if isinstance(class_name, str) else '', slot_features))
+
+    def _index_features(self):
+        gained = {}
+        for level, features in _levels(self.class_info.get('classFeatures')):
+            gained.setdefault(level, []).extend(_dicts(features))
+        for level, features in _levels(_selected_subclass(self.class_info).get('features')):
+            gained.setdefault(level, []).extend(_dicts(features))
+        self.features = []
+        self.ends = []
+        for level in sorted(gained):
+            self.features.extend(gained[level])
+            self.ends.append(len(self.features))
+        self.levels = sorted(gained)
+
+    def features_up_to(self, level):
+        """Every class and subclass feature gained at or below level, in level order"""
+        if self.levels is None:
+            self._index_features()
+        i = bisect_right(self.levels, level)
+        return self.features[:self.ends[i - 1]] if i else []
+
+    def slots_at(self, level):
+        """Spell slots per spell level at a class level"""
+        return self.slots.at(level)
+
+class CharacterIndex:
+    """Single pass over an export's collections, grouped the way the extractors read them"""
+
+    def __init__(self, data):
+        self.classes = _dicts(data.get('class'))
+        
+        self.spells = []
+        self.invocations = []
+        self.spells_by_level = {}
+        for spell in _dicts(data.get('spells')):
+            self.spells.append(spell)
+            school = spell.get('school')
+            if school == 'Invocation':
+                self.invocations.append(spell)
+            else:
+                _group(self.spells_by_level, spell.get('level', 0), spell)
+        
+        self.equipment = []
+        self.equipment_by_type = {}
+        self.equipped_weapons = []
+        for item in _dicts(data.get('equipment')):
+            self.equipment.append(item)
+            item_type = item.get('type', '')
+            _group(self.equipment_by_type, item_type, item)
+            if item.get('equipped') and isinstance(item_type, str) and 'Weapon' in item_type:
+                self.equipped_weapons.append(item)
+        
+        self.features = _dicts(data.get('featuresAndTraits'))
+        self.action_features = []
+        self.spell_slot_features = []
+        for feature in self.features:
+            if _is_action_feature(feature):
+                self.action_features.append(feature)
+            if 'spellSlotsPerLevel' in feature:
+                self.spell_slot_features.append(feature)
+        
+        species_data = data.get('species', {})
+        traits = species_data.get('traits', []) if isinstance(species_data, dict) else []
+        self.action_traits = [trait for trait in _dicts(traits) if _is_action_trait(trait)]
+        self._class_tables = {}
+
+    def class_table(self, class_info):
+        """ClassTable for one entry of classes, built on first use"""
+        table = self._class_tables.get(id(class_info))
+        if table is None:
+            table = self._class_tables[id(class_info)] = ClassTable(class_info, self.spell_slot_features)
+        return table
+
+ABILITIES = ['Strength', 'Dexterity', 'Constitution', 'Intelligence', 'Wisdom', 'Charisma']
+SKILLS_BY_ABILITY = {
+    'Strength': ['Athletics'],
+    'Dexterity': ['Acrobatics', 'Sleight of Hand', 'Stealth'],
+    'Intelligence': ['Arcana', 'History', 'Investigation', 'Nature', 'Religion'],
+    'Wisdom': ['Animal Handling', 'Insight', 'Medicine', 'Perception', 'Survival'],
+    'Charisma': ['Deception', 'Intimidation', 'Performance', 'Persuasion']
+}
+
+def _ability_score(value):
+    """Normalize an ability score from the export, falling back to 10"""
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return 10
+
+def _truthy_keys(mapping):
+    """Keys of a {name: flag} export field whose flag is set"""
+    return {k for k, v in mapping.items() if v} if isinstance(mapping, dict) else set()
+
+def _memoized(method):
+    """Read-only property computed on first access and kept in the instance's _derived dict"""
+    name = method.__name__
+    
+    def getter(self):
+        try:
+            return self._derived[name]
+        except KeyError:
+            value = self._derived[name] = method(self)
+            return value
+    return property(getter, doc=method.__doc__)
+
+class Character:
+    """Export parsed once into normalized scores, with memoized derived stats"""
+
+    __slots__ = ('data', 'scores', 'proficiency_bonus',
+                 'skill_proficiencies', 'skill_expertise', '_derived')
+
+    def __init__(self, data, index=None):
+        self.data = data
+        self._derived = {'index': index} if index else {}
+        # Check both 'abilityScores' and 'attributes' fields
+        abilities = data.get('abilityScores', data.get('attributes', {}))
+        if not isinstance(abilities, dict):
+            abilities = {}
+        self.scores = {ability: _ability_score(score) for ability, score in abilities.items()}
+        for ability in ABILITIES:
+            self.scores.setdefault(ability, 10)
+        self.proficiency_bonus = data.get('proficiencyBonus', 2)
+        self.skill_proficiencies = _truthy_keys(data.get('skillProficiencies', {}))
+        self.skill_expertise = _truthy_keys(data.get('skillExpertise', {}))
+
+    def score(self, ability):
+        """Normalized score for any ability name, 10 if the export lacks it"""
+        return self.scores.get(ability, 10)
+
+    def modifier(self, ability):
+        """Ability modifier for any ability name"""
+        return self.modifiers.get(ability, 0)
+
+    @_memoized
+    def index(self):
+        """CharacterIndex over the export's collections, built on first use"""
+        return CharacterIndex(self.data)
+
+    @_memoized
+    def species(self):
+        """The species object, or {} when the export lacks one"""
+        species_data = self.data.get('species', {})
+        return species_data if isinstance(species_data, dict) else {}
+
+    @_memoized
+    def spell_lists(self):
+        """(short list, detailed list) HTML for all spells"""
+        return extract_spells(self.data.get('spells', []), index=self.index)
+
+    def field_digest(self, field):
+        """Hash of one top-level export field, memoized per render"""
+        key = ('digest', field)
+        digest = self._derived.get(key)
+        if digest is None:
+            if field in self.data:
+                value = self.data[field]
+                try:
+                    # marshal serializes plain JSON trees several times faster than json.dumps
+                    encoded = marshal.dumps(value)
+                except ValueError:
+                    encoded = json.dumps(value, separators=(',', ':'), default=str).encode('utf-8')
+            else:
+                # Distinct from an explicit null, which some sections treat differently
+                encoded = b'\0missing'
+            digest = self._derived[key] = hashlib.sha256(encoded).digest()
+        return digest
+
+    def fields_digest(self, fields):
+        """Combined hash of several top-level export fields"""
+        return hashlib.sha256(b''.join(self.field_digest(field) for field in fields)).digest()
+
+    @_memoized
+    def modifiers(self):
+        """Ability modifiers keyed by ability name"""
+        return {ability: (score - 10) // 2 for ability, score in self.scores.items()}
+
+    @_memoized
+    def total_level(self):
+        """Sum of all class levels"""
+        return sum(c.get('level', 1) for c in self.index.classes)
+
+    @_memoized
+    def skills(self):
+        """(bonus, 'expertise' | 'proficient' | '') for every skill, keyed by skill name"""
+        skills = {}
+        for ability, ability_skills in SKILLS_BY_ABILITY.items():
+            ability_mod = self.modifier(ability)
+            for skill in ability_skills:
+                if skill in self.skill_expertise:
+                    skills[skill] = (ability_mod + (self.proficiency_bonus * 2), 'expertise')
+                elif skill in self.skill_proficiencies:
+                    skills[skill] = (ability_mod + self.proficiency_bonus, 'proficient')
+                else:
+                    skills[skill] = (ability_mod, '')
+        return skills
+
+    @_memoized
+    def passive_perception(self):
+        """10 + Wisdom modifier, plus proficiency for Perception proficiency and expertise"""
+        perception_bonus = self.modifier('Wisdom')
+        if 'Perception' in self.skill_proficiencies:
+            perception_bonus += self.proficiency_bonus
+        if 'Perception' in self.skill_expertise:
+            perception_bonus += self.proficiency_bonus
+        return 10 + perception_bonus
+
+def signed(value):
+    """Format a bonus with an explicit sign, e.g. +2 or -1"""
+    return f"+{value}" if value >= 0 else str(value)
 
 def extract_features(features_data):
     """Extract and format features from JSON data"""
@@ -38,68 +875,60 @@ def extract_features(features_data):
         for feature in features_data:
             if isinstance(feature, dict):
                 name = feature.get('name', 'Unknown Feature') + ':'
-                description = feature.get('description', feature.get('text', '')).replace('\n', '<br>')
-                description = style_source_text(description)
-                features_html.append(FEATURE_ITEM.substitute(name=name, description=description))
+                description = feature.get('description', feature.get('text', ''))
+                features_html.append(format_feature_item(name, description))
             elif isinstance(feature, str):
                 features_html.append(FEATURE_ITEM.substitute(name='', description=feature))
     
     return ''.join(features_html) if features_html else "No features available"
 
-def extract_class_features(class_features_data, character_level):
-    """Extract class features up to character level"""
-    if not class_features_data:
+def extract_class_features(class_data, character_level=None, index=None):
+    """Extract class features up to character level
+    
+    class_data is a class entry, whose own level and selected subclass are
+    used, or its classFeatures mapping together with character_level.
+    """
+    if not class_data or not isinstance(class_data, dict):
         return "No features available"
     
+    if character_level is None or 'classFeatures' in class_data:
+        class_info = class_data
+        if character_level is None:
+            character_level = class_info.get('level', 1)
+    else:
+        class_info = {'classFeatures': class_data}
+    table = index.class_table(class_info) if index else ClassTable(class_info)
     features_html = []
-    for level_str, level_features in class_features_data.items():
-        try:
-            level = int(level_str)
-            if level <= character_level and isinstance(level_features, list):
-                for feature in level_features:
-                    if isinstance(feature, dict):
-                        name = feature.get('name', 'Unknown Feature') + ':'
-                        description = feature.get('description', '').replace('\n', '<br>')
-                        description = style_source_text(description)
-                        features_html.append(FEATURE_ITEM.substitute(name=name, description=description))
-        except ValueError:
-            continue
+    for feature in table.features_up_to(_level(character_level)):
+        name = feature.get('name', 'Unknown Feature') + ':'
+        features_html.append(format_feature_item(name, feature.get('description', '')))
     
     return ''.join(features_html) if features_html else "No features available"
 
-def extract_spells(spells_data, class_name=None):
+def extract_spells(spells_data, class_name=None, index=None):
     """Extract and format spells from JSON data, organized by level"""
     if not spells_data:
         return "No spells available", "No spells available"
     
+    index = index or CharacterIndex({'spells': spells_data})
+    invocations = index.invocations
+    spells_by_level = index.spells_by_level
+    
     # Filter spells by class if specified
-    filtered_spells = spells_data
     if class_name:
-        filtered_spells = [s for s in spells_data if isinstance(s, dict) and 
-                          class_name in s.get('preparingClass', '')]
+        filtered_spells = [s for s in index.spells if class_name in s.get('preparingClass', '')]
         # Include invocations for Warlock
         if 'Warlock' in class_name:
-            invocations = [s for s in spells_data if isinstance(s, dict) and 
-                          s.get('school') == 'Invocation']
-            filtered_spells.extend(invocations)
-    
-    if not filtered_spells:
-        return "No spells available", "No spells available"
-    
-    # Separate invocations from regular spells
-    invocations = [s for s in filtered_spells if isinstance(s, dict) and 
-                  s.get('school') == 'Invocation']
-    regular_spells = [s for s in filtered_spells if isinstance(s, dict) and 
-                     s.get('school') != 'Invocation']
-    
-    # Organize spells by level
-    spells_by_level = {}
-    for spell in regular_spells:
-        if isinstance(spell, dict):
-            level = spell.get('level', 0)
-            if level not in spells_by_level:
-                spells_by_level[level] = []
-            spells_by_level[level].append(spell)
+            filtered_spells.extend(index.invocations)
+        if not filtered_spells:
+            return "No spells available", "No spells available"
+        
+        # Separate invocations from regular spells and organize by level
+        invocations = [s for s in filtered_spells if s.get('school') == 'Invocation']
+        spells_by_level = {}
+        for spell in filtered_spells:
+            if spell.get('school') != 'Invocation':
+                spells_by_level.setdefault(spell.get('level', 0), []).append(spell)
     
     # Short list - just names with preparing class
     short_list = []
@@ -115,9 +944,7 @@ def extract_spells(spells_data, class_name=None):
         detailed_list.append(f"<h4>Invocations</h4>")
         for inv in invocations:
             name = inv.get('title', 'Unknown Invocation')
-            description = inv.get('description', '').replace('\n', '<br>')
-            description = style_source_text(description)
-            detailed_list.append(FEATURE_ITEM.substitute(name=name, description=description))
+            detailed_list.append(format_feature_item(name, inv.get('description', '')))
     
     # Sort levels (cantrips first, then 1st, 2nd, etc.)
     for level in sorted(spells_by_level.keys()):
@@ -137,63 +964,59 @@ def extract_spells(spells_data, class_name=None):
             casting_time = spell.get('castingTime', '')
             range_val = spell.get('range', '')
             duration = spell.get('duration', '')
-            description = spell.get('description', '').replace('\n', '<br>')
-            description = style_source_text(description)
+            description = spell.get('description', '')
             
-            detailed_list.append(SPELL_ITEM.substitute(
-                name=name, school=school, casting_time=casting_time,
-                range=range_val, duration=duration, description=description
-            ))
+            detailed_list.append(format_spell_item(name, school, casting_time, range_val, duration, description))
     
     return ''.join(short_list) if short_list else "No spells available", ''.join(detailed_list) if detailed_list else "No spells available"
 
-def extract_weapons(equipment_data, proficiency_bonus=2):
+def extract_weapons(equipment_data, proficiency_bonus=2, index=None):
     """Extract weapons from equipment data"""
     if not equipment_data:
         return "No weapons available"
     
+    index = index or CharacterIndex({'equipment': equipment_data})
     weapons_html = []
-    for item in equipment_data:
-        if isinstance(item, dict) and item.get('type') == 'Melee Weapon':
-            name = item.get('title', 'Unknown Weapon')
-            hit_bonus = item.get('hitBonus', 0)
-            damages = item.get('damages', {})
-            damage_str = ', '.join([f"{dmg_type}: {formula.replace('+pb', f'+{proficiency_bonus}')}" for dmg_type, formula in damages.items()])
-            properties = item.get('properties', '')
-            
-            weapons_html.append(WEAPON_ITEM.substitute(
-                name=name, hit_bonus=hit_bonus, damage=damage_str, properties=properties
-            ))
+    for item in index.equipment_by_type.get('Melee Weapon', []):
+        name = item.get('title', 'Unknown Weapon')
+        hit_bonus = item.get('hitBonus', 0)
+        damages = item.get('damages', {})
+        damage_str = ', '.join([f"{dmg_type}: {formula.replace('+pb', f'+{proficiency_bonus}')}" for dmg_type, formula in damages.items()])
+        properties = item.get('properties', '')
+        
+        weapons_html.append(WEAPON_ITEM.substitute(
+            name=name, hit_bonus=hit_bonus, damage=damage_str, properties=properties
+        ))
     
     return ''.join(weapons_html) if weapons_html else "No weapons available"
 
-def extract_inventory(equipment_data):
+def extract_inventory(equipment_data, index=None):
     """Extract inventory items from equipment data"""
     if not equipment_data:
         return "No items available"
     
+    index = index or CharacterIndex({'equipment': equipment_data})
     inventory_html = []
-    for item in equipment_data:
-        if isinstance(item, dict):
-            name = item.get('title', 'Unknown Item')
-            quantity = item.get('quantity', 1)
-            weight = item.get('weight', 0)
-            item_type = item.get('type', 'Item')
-            equipped = item.get('equipped', False)
-            
-            status = " (Equipped)" if equipped else ""
-            inventory_html.append(INVENTORY_ITEM.substitute(
-                name=name, status=status, type=item_type, quantity=quantity, weight=weight
-            ))
+    for item in index.equipment:
+        name = item.get('title', 'Unknown Item')
+        quantity = item.get('quantity', 1)
+        weight = item.get('weight', 0)
+        item_type = item.get('type', 'Item')
+        equipped = item.get('equipped', False)
+        
+        status = " (Equipped)" if equipped else ""
+        inventory_html.append(INVENTORY_ITEM.substitute(
+            name=name, status=status, type=item_type, quantity=quantity, weight=weight
+        ))
     
     return ''.join(inventory_html) if inventory_html else "No items available"
 
-def extract_actions(data):
+def extract_actions(data, index=None, character=None):
     """Extract combat actions with limited uses and recharge info"""
-    import re
+    character = character or Character(data, index)
+    index = character.index
     actions_html = []
-    proficiency_bonus = data.get('proficiencyBonus', 2)
-    abilities = data.get('abilityScores', data.get('attributes', {}))
+    proficiency_bonus = character.proficiency_bonus
     
     def calculate_uses(feature):
         uses = 0
@@ -207,25 +1030,39 @@ def extract_actions(data):
                 if scale_type == 'proficiency':
                     uses = proficiency_bonus + base
                 elif scale_type == 'attribute':
-                    attr = scaling.get('attribute', '')
-                    ability_score = abilities.get(attr, 10)
-                    try:
-                        ability_score = int(ability_score)
-                    except (ValueError, TypeError):
-                        ability_score = 10
-                    modifier = (ability_score - 10) // 2
+                    modifier = character.modifier(scaling.get('attribute', ''))
                     uses = max(1, modifier + base)
                 elif scale_type == 'level':
-                    total_level = sum(c.get('level', 1) for c in data.get('class', []) if isinstance(c, dict))
-                    uses = total_level + base
+                    uses = character.total_level + base
         
         if uses == 0:
             uses = int(feature.get('customResource', 0)) if feature.get('customResource') else 0
         return uses
     
+    def action_item(feature):
+        name = feature.get('name', '')
+        description = feature.get('description', '')
+        uses = calculate_uses(feature)
+        if uses == 0:
+            uses_match = _USES_PHRASE.search(description)
+            if uses_match:
+                use_text = uses_match.group(1).lower()
+                if use_text == 'once': uses = 1
+                elif use_text == 'twice': uses = 2
+                elif use_text == 'thrice': uses = 3
+                else: uses = int(_DIGITS.search(use_text).group())
+        
+        recharge_match = _RECHARGE.search(description)
+        recharge = 'Short' if recharge_match and 'Short' in recharge_match.group() else ('Long' if recharge_match else '')
+        
+        if uses > 0:
+            boxes = ''.join(['<span class="prof-indicator"></span>'] * uses)
+            recharge_text = f'{recharge} Rest' if recharge else ''
+            return f'<div class="feature-item"><strong>{name}</strong><div class="uses-row"><span>{recharge_text}</span><span class="uses-boxes">{boxes}</span></div></div>'
+        return f'<div class="feature-item"><strong>{name}</strong></div>'
+    
     # Add attack action with equipped weapons
-    equipment_data = data.get('equipment', [])
-    equipped_weapons = [item.get('title', 'Weapon') for item in equipment_data if isinstance(item, dict) and item.get('equipped') and 'Weapon' in item.get('type', '')]
+    equipped_weapons = [item.get('title', 'Weapon') for item in index.equipped_weapons]
     if equipped_weapons:
         weapons_list = ', '.join(equipped_weapons)
         actions_html.append(f'<div class="feature-item"><strong>Attack</strong><div class="feature-text">{weapons_list}</div></div>')
@@ -233,84 +1070,22 @@ def extract_actions(data):
         actions_html.append('<div class="feature-item"><strong>Attack</strong></div>')
     
     # Add species-specific actions
-    species_data = data.get('species', {})
-    if isinstance(species_data, dict):
-        traits = species_data.get('traits', [])
-        for trait in traits:
-            if isinstance(trait, dict):
-                name = trait.get('name', '')
-                description = trait.get('description', '')
-                if 'breath' in name.lower() or 'action' in description.lower():
-                    uses = calculate_uses(trait)
-                    if uses == 0:
-                        uses_match = re.search(r'use this feature (once|twice|thrice|\d+ times?)', description, re.IGNORECASE)
-                        if uses_match:
-                            use_text = uses_match.group(1).lower()
-                            if use_text == 'once': uses = 1
-                            elif use_text == 'twice': uses = 2
-                            elif use_text == 'thrice': uses = 3
-                            else: uses = int(re.search(r'\d+', use_text).group())
-                    
-                    recharge_match = re.search(r'Short Rest|Long Rest', description)
-                    recharge = 'Short' if recharge_match and 'Short' in recharge_match.group() else ('Long' if recharge_match else '')
-                    
-                    if uses > 0:
-                        boxes = ''.join(['<span class="prof-indicator"></span>'] * uses)
-                        recharge_text = f'{recharge} Rest' if recharge else ''
-                        actions_html.append(f'<div class="feature-item"><strong>{name}</strong><div class="uses-row"><span>{recharge_text}</span><span class="uses-boxes">{boxes}</span></div></div>')
-                    else:
-                        actions_html.append(f'<div class="feature-item"><strong>{name}</strong></div>')
+    for trait in index.action_traits:
+        actions_html.append(action_item(trait))
     
     # Add class-specific actions
-    features_data = data.get('featuresAndTraits', [])
-    if isinstance(features_data, list):
-        for feature in features_data:
-            if isinstance(feature, dict):
-                name = feature.get('name', '')
-                description = feature.get('description', '')
-                desc_lower = description.lower()
-                if any(keyword in desc_lower for keyword in ['action', 'bonus action', 'reaction']) or re.search(r'\battack\b', desc_lower):
-                    uses = calculate_uses(feature)
-                    if uses == 0:
-                        uses_match = re.search(r'use this feature (once|twice|thrice|\d+ times?)', description, re.IGNORECASE)
-                        if uses_match:
-                            use_text = uses_match.group(1).lower()
-                            if use_text == 'once': uses = 1
-                            elif use_text == 'twice': uses = 2
-                            elif use_text == 'thrice': uses = 3
-                            else: uses = int(re.search(r'\d+', use_text).group())
-                    
-                    recharge_match = re.search(r'Short Rest|Long Rest', description)
-                    recharge = 'Short' if recharge_match and 'Short' in recharge_match.group() else ('Long' if recharge_match else '')
-                    
-                    if uses > 0:
-                        boxes = ''.join(['<span class="prof-indicator"></span>'] * uses)
-                        recharge_text = f'{recharge} Rest' if recharge else ''
-                        actions_html.append(f'<div class="feature-item"><strong>{name}</strong><div class="uses-row"><span>{recharge_text}</span><span class="uses-boxes">{boxes}</span></div></div>')
-                    else:
-                        actions_html.append(f'<div class="feature-item"><strong>{name}</strong></div>')
+    for feature in index.action_features:
+        actions_html.append(action_item(feature))
     
     return ''.join(actions_html) if actions_html else '<div class="feature-item"><strong>Attack</strong></div>'
 
-def extract_spell_slots(class_info, features_list):
+def extract_spell_slots(class_info, features_list, index=None):
     """Extract spell slot information for a specific class"""
     if not isinstance(class_info, dict):
         return "No spell slots available"
     
-    character_level = class_info.get('level', 1)
-    class_name = class_info.get('name', '')
-    spell_slots = []
-    
-    # Look for spellSlotsPerLevel in features matching this class
-    for feature in features_list:
-        if isinstance(feature, dict) and 'spellSlotsPerLevel' in feature:
-            feature_type = feature.get('type', '')
-            # Match feature to class by checking if class name is in feature type
-            if class_name.replace(' [2024]', '') in feature_type or class_name in feature_type:
-                slots_per_level = feature.get('spellSlotsPerLevel', {})
-                if str(character_level) in slots_per_level:
-                    spell_slots = slots_per_level[str(character_level)]
-                    break
+    index = index or CharacterIndex({'featuresAndTraits': features_list})
+    spell_slots = index.class_table(class_info).slots_at(_level(class_info.get('level', 1)))
     
     if not spell_slots:
         return "No spell slots available"
@@ -323,21 +1098,24 @@ def extract_spell_slots(class_info, features_list):
     
     return ''.join(slots_html) if slots_html else "No spell slots available"
 
-def fill_template(template_file, data, output_file):
-    """Fill HTML template with JSON data"""
-    try:
-        with open(template_file, 'r', encoding='utf-8') as f:
-            template_content = f.read()
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Template file not found: {template_file}")
-    except Exception as e:
-        raise Exception(f"Error reading template file: {e}")
+def fill_template(template_file, data, output_file, minify=False, timings=None):
+    """Fill HTML template with JSON data and write it to output_file
     
-    template = Template(template_content)
+    If timings is a dict, the seconds spent in each stage and section are added to it.
+    """
+    filled_content = render_sheet_parts(data, template_file, minify=minify, timings=timings)[0]
     
-    # Extract relevant data for template
+    try:
+        with timed(timings, 'write'):
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write(filled_content)
+    except Exception as e:
+        raise Exception(f"Error writing output file: {e}")
+
+def _classes_section(character):
+    """'Fighter 3 / Wizard 2' summary of the character's classes"""
     classes_info = []
-    class_data = data.get('class', [])
+    class_data = character.data.get('class', [])
     if isinstance(class_data, list):
         for cls in class_data:
             if isinstance(cls, dict):
@@ -345,168 +1123,203 @@ def fill_template(template_file, data, output_file):
     elif isinstance(class_data, dict):
         # Handle single class as dict instead of list
         classes_info.append(f"{class_data.get('name', 'Unknown')} {class_data.get('level', 1)}")
-    
-    # Build ability scores table - check both 'abilityScores' and 'attributes' fields
-    abilities = data.get('abilityScores', data.get('attributes', {}))
-    if not isinstance(abilities, dict):
-        abilities = {}
-    
-    ability_stats = ""
-    for ability in ['Strength', 'Dexterity', 'Constitution', 'Intelligence', 'Wisdom', 'Charisma']:
-        score = abilities.get(ability, 10)
-        # Ensure score is a number
-        try:
-            score = int(score)
-        except (ValueError, TypeError):
-            score = 10
-        
-        modifier = (score - 10) // 2
-        mod_str = f"+{modifier}" if modifier >= 0 else str(modifier)
-        short_name = ability[:3].upper()
-        ability_stats += f'<div class="stat"><label>{short_name}</label><div class="stat-value">{score}</div><div class="stat-mod">{mod_str}</div></div>'
-    
-    # Extract skill proficiencies
-    proficiency_bonus = data.get('proficiencyBonus', 2)
-    skills_html = []
-    
-    # Get skill proficiencies from top-level fields
-    skill_proficiencies = {k: v for k, v in data.get('skillProficiencies', {}).items() if v}
-    skill_expertise = {k: v for k, v in data.get('skillExpertise', {}).items() if v}
-    
-    # Build ability groups with skills
-    skills_by_ability = {
-        'Strength': ['Athletics'],
-        'Dexterity': ['Acrobatics', 'Sleight of Hand', 'Stealth'],
-        'Intelligence': ['Arcana', 'History', 'Investigation', 'Nature', 'Religion'],
-        'Wisdom': ['Animal Handling', 'Insight', 'Medicine', 'Perception', 'Survival'],
-        'Charisma': ['Deception', 'Intimidation', 'Performance', 'Persuasion']
+    return ' / '.join(classes_info) if classes_info else 'Unknown'
+
+def _abilities_section(character):
+    """Ability score blocks, each with its skills"""
+    prof_indicators = {
+        'expertise': '<span class="prof-indicator expertise">E</span>',
+        'proficient': '<span class="prof-indicator proficient">P</span>',
+        '': '<span class="prof-indicator"></span>',
     }
+    skills = character.skills
     
     ability_groups = []
-    for ability in ['Strength', 'Dexterity', 'Constitution', 'Intelligence', 'Wisdom', 'Charisma']:
-        ability_score = abilities.get(ability, 10)
-        try:
-            ability_score = int(ability_score)
-        except (ValueError, TypeError):
-            ability_score = 10
-        
-        ability_mod = (ability_score - 10) // 2
-        mod_str = f"+{ability_mod}" if ability_mod >= 0 else str(ability_mod)
+    for ability in ABILITIES:
         short_name = ability[:3].upper()
         
         group_html = '<div class="ability-group">'
         group_html += '<div class="abilities-skills-layout">'
-        group_html += f'<div class="stat"><label>{short_name}</label><div class="stat-value">{ability_score}</div><div class="stat-mod">{mod_str}</div></div>'
+        group_html += f'<div class="stat"><label>{short_name}</label><div class="stat-value">{character.score(ability)}</div><div class="stat-mod">{signed(character.modifier(ability))}</div></div>'
         group_html += '<div class="skills-box">'
         
-        if ability in skills_by_ability:
-            for skill in skills_by_ability[ability]:
-                if skill in skill_expertise:
-                    bonus = ability_mod + (proficiency_bonus * 2)
-                    prof_indicator = '<span class="prof-indicator expertise">E</span>'
-                elif skill in skill_proficiencies:
-                    bonus = ability_mod + proficiency_bonus
-                    prof_indicator = '<span class="prof-indicator proficient">P</span>'
-                else:
-                    bonus = ability_mod
-                    prof_indicator = '<span class="prof-indicator"></span>'
-                
-                bonus_str = f"+{bonus}" if bonus >= 0 else str(bonus)
-                group_html += f'<div class="skill-item"><span class="skill-name">{skill}</span>{prof_indicator}<span class="skill-bonus">{bonus_str}</span></div>'
+        for skill in SKILLS_BY_ABILITY.get(ability, []):
+            bonus, proficiency = skills[skill]
+            group_html += f'<div class="skill-item"><span class="skill-name">{skill}</span>{prof_indicators[proficiency]}<span class="skill-bonus">{signed(bonus)}</span></div>'
         
         group_html += '</div></div></div>'
         ability_groups.append(group_html)
     
-    abilities_skills_grouped = ''.join(ability_groups)
-    
-    # Parse notes - handle various note formats
-    notes_text = "No notes available"
-    notes_data = data.get('notes', [])
-    if notes_data:
-        parsed_notes = []
-        if isinstance(notes_data, list):
-            for note in notes_data:
-                if isinstance(note, dict):
-                    title = note.get('title', 'Note')
-                    content = note.get('content', '')
-                    # Parse content if it's JSON string
-                    if isinstance(content, str) and content.startswith('[{"insert"'):
-                        try:
-                            import re
-                            # Extract text from insert format
-                            text = re.findall(r'"insert":"([^"]+)"', content)
-                            content = ''.join(text).replace('\\n', '<br>')
-                        except:
-                            pass
-                    else:
-                        content = content.replace('\n', '<br>')
-                    parsed_notes.append(f'<div class="feature-item"><strong>{title}</strong><div class="feature-text">{content}</div></div>')
-                elif isinstance(note, str):
-                    parsed_notes.append(f'<div class="feature-item"><div class="feature-text">{note.replace(chr(10), "<br>")}</div></div>')
-        elif isinstance(notes_data, str):
-            parsed_notes.append(f'<div class="feature-item"><div class="feature-text">{notes_data.replace(chr(10), "<br>")}</div></div>')
-        
-        notes_text = ''.join(parsed_notes) if parsed_notes else "No notes available"
-    
-    # Get additional character information with safe access
-    background_data = data.get('background', {})
-    background_name = background_data.get('name', 'Unknown') if isinstance(background_data, dict) else 'Unknown'
-    
-    alignment = data.get('alignment', 'Unknown')
-    max_hp = data.get('maxHP', data.get('currentHP', 'Unknown'))
-    armor_class = data.get('armorClass', 'Unknown')
-    
-    # Calculate derived stats
-    dex_score = abilities.get('Dexterity', 10)
-    try:
-        dex_score = int(dex_score)
-    except (ValueError, TypeError):
-        dex_score = 10
-    dex_mod = (dex_score - 10) // 2
-    initiative = f"+{dex_mod}" if dex_mod >= 0 else str(dex_mod)
-    
-    wis_score = abilities.get('Wisdom', 10)
+    return ''.join(ability_groups)
+
+_QUILL_INLINE = (('bold', 'strong'), ('italic', 'em'), ('underline', 'u'), ('strike', 's'), ('code', 'code'))
+_QUILL_LISTS = {'bullet': 'ul', 'ordered': 'ol', 'checked': 'ul', 'unchecked': 'ul'}
+
+def _quill_ops(content):
+    """Yield the ops of a Quill delta, decoding JSON text one op at a time
+
+    content is the delta's JSON text, its list of ops or {"ops": [...]}.
+    Text past the last op a caller asks for is never decoded.
+    """
+    if isinstance(content, dict):
+        content = content.get('ops', [])
+    if isinstance(content, list):
+        yield from content
+        return
+    pos = _QUILL_DELIMITER.match(content, content.index('[') + 1).end()
+    while pos < len(content) and content[pos] != ']':
+        op, pos = _json_decoder.raw_decode(content, pos)
+        yield op
+        pos = _QUILL_DELIMITER.match(content, pos).end()
+
+def _quill_inline(text, attributes):
+    """HTML for one run of delta text with its inline formatting"""
+    text = escape(text, quote=False)
+    for attribute, tag in _QUILL_INLINE:
+        if attributes.get(attribute):
+            text = f'<{tag}>{text}</{tag}>'
+    link = attributes.get('link')
+    if isinstance(link, str) and _SAFE_LINK.match(link):
+        text = f'<a href="{escape(link)}">{text}</a>'
+    return text
+
+def append_quill_html(content, out, limit=NOTE_MAX_CHARS):
+    """Append the HTML of a Quill delta to the list out, one paragraph, heading or list item per line
+    
+    Ops are decoded as they are rendered, and decoding stops once limit
+    characters of text have been written, so the cost of a note is bounded
+    however long its delta is. Malformed JSON ends the note where it breaks,
+    and malformed attributes are ignored.
+    """
+    line = []
+    open_list = None
+    remaining = limit
+
+    def end_line(attributes):
+        nonlocal open_list
+        list_type = attributes.get('list')
+        list_tag = _QUILL_LISTS.get(list_type) if isinstance(list_type, str) else None
+        if list_tag != open_list:
+            if open_list:
+                out.append(f'</{open_list}>')
+            if list_tag:
+                out.append(f'<{list_tag}>')
+            open_list = list_tag
+        header = attributes.get('header')
+        if list_tag:
+            tag = 'li'
+        elif isinstance(header, int) and header > 0:
+            # Notes sit under the sheet's own <h2> headings
+            tag = f'h{min(header + 3, 6)}'
+        elif attributes.get('blockquote'):
+            tag = 'blockquote'
+        else:
+            tag = 'p'
+        out.append(f'<{tag}>')
+        out.extend(line or ['<br>'])
+        out.append(f'</{tag}>')
+        line.clear()
+
     try:
-        wis_score = int(wis_score)
-    except (ValueError, TypeError):
-        wis_score = 10
-    wis_mod = (wis_score - 10) // 2
-    
-    # Check if proficient in Perception
-    perception_bonus = wis_mod
-    if 'Perception' in skill_proficiencies:
-        perception_bonus += proficiency_bonus
-    if 'Perception' in skill_expertise:
-        perception_bonus += proficiency_bonus
-    passive_perception = 10 + perception_bonus
-    
-    # Hit dice - create vertical list
+        for op in _quill_ops(content):
+            text = op.get('insert') if isinstance(op, dict) else None
+            if not isinstance(text, str):
+                # Embeds (images, formulas, ...) have no text to show
+                continue
+            attributes = op.get('attributes')
+            if not isinstance(attributes, dict):
+                attributes = {}
+            for i, piece in enumerate(text.split('\n')):
+                if i:
+                    end_line(attributes)
+                if not piece:
+                    continue
+                if len(piece) >= remaining:
+                    line.append(_quill_inline(piece[:remaining], attributes) + '…')
+                    remaining = 0
+                    break
+                line.append(_quill_inline(piece, attributes))
+                remaining -= len(piece)
+            if not remaining:
+                break
+    except ValueError:
+        pass
+    if line:
+        end_line({})
+    if open_list:
+        out.append(f'</{open_list}>')
+
+def _capped(text, limit=NOTE_MAX_CHARS):
+    """text cut to limit characters, marked with an ellipsis when cut"""
+    return text if len(text) <= limit else text[:limit] + '…'
+
+def _append_notes(notes_data, out):
+    """Append the HTML of a notes field (plain text, string list or note objects) to the list out"""
+    if isinstance(notes_data, str):
+        notes_data = [notes_data]
+    elif not isinstance(notes_data, list):
+        return
+    for note in notes_data:
+        if isinstance(note, dict):
+            title = note.get('title', 'Note')
+            content = note.get('content', '')
+            out.append(f'<div class="feature-item"><strong>{title}</strong><div class="feature-text">')
+            if isinstance(content, (list, dict)) or (isinstance(content, str) and content.startswith('[{"insert"')):
+                append_quill_html(content, out)
+            elif isinstance(content, str):
+                out.append(_capped(content).replace('\n', '<br>'))
+            out.append('</div></div>')
+        elif isinstance(note, str):
+            out.append(f'<div class="feature-item"><div class="feature-text">{_capped(note).replace(chr(10), "<br>")}</div></div>')
+
+def _notes_section(character):
+    """Notes, handling plain text, string lists and Quill-delta content, then archived notes"""
+    out = []
+    _append_notes(character.data.get('notes'), out)
+    if ARCHIVED_NOTES in ('collapse', 'show'):
+        archived = len(out)
+        _append_notes(character.data.get('archivedNotes'), out)
+        if ARCHIVED_NOTES == 'collapse' and len(out) > archived:
+            out.insert(archived, '<details class="archived-notes"><summary>Archived notes</summary>')
+            out.append('</details>')
+    return ''.join(out) if out else "No notes available"
+
+def _background_section(character):
+    """Background name"""
+    background_data = character.data.get('background', {})
+    return background_data.get('name', 'Unknown') if isinstance(background_data, dict) else 'Unknown'
+
+def _hit_dice_section(character):
+    """Hit dice per class, e.g. '3d10, 2d6'"""
     hit_dice_html = []
-    for class_info in data.get('class', []):
-        if isinstance(class_info, dict):
-            level = class_info.get('level', 1)
-            die = class_info.get('hitPointDie', 'd10')
-            # Die format is already like '1d10', just use level and die type
-            if die.startswith('1d'):
-                die_type = die[1:]  # Remove the '1' to get 'd10'
-                die_str = f"{level}{die_type}"
-            else:
-                die_str = f"{level}{die}"
-            hit_dice_html.append(die_str)
-    hit_dice_str = ', '.join(hit_dice_html) if hit_dice_html else '1d10'
-    
-    # Languages and proficiencies
-    languages = ', '.join(data.get('languages', [])) if data.get('languages') else 'Common'
-    
-    # Collect all proficiencies
+    for class_info in character.index.classes:
+        level = class_info.get('level', 1)
+        die = class_info.get('hitPointDie', 'd10')
+        # Die format is already like '1d10', just use level and die type
+        if die.startswith('1d'):
+            die_type = die[1:]  # Remove the '1' to get 'd10'
+            die_str = f"{level}{die_type}"
+        else:
+            die_str = f"{level}{die}"
+        hit_dice_html.append(die_str)
+    return ', '.join(hit_dice_html) if hit_dice_html else '1d10'
+
+def _languages_section(character):
+    """Comma-separated languages"""
+    data = character.data
+    return ', '.join(data.get('languages', [])) if data.get('languages') else 'Common'
+
+def _proficiencies_section(character):
+    """Weapon, armor and tool proficiencies"""
+    data = character.data
     prof_list = []
     if data.get('weaponProficiencies'):
         prof_list.extend(data.get('weaponProficiencies'))
     
     # Get armor training from classes
     armor_profs = set()
-    for class_info in data.get('class', []):
-        if isinstance(class_info, dict) and class_info.get('armorTraining'):
+    for class_info in character.index.classes:
+        if class_info.get('armorTraining'):
             armor_profs.update([a.strip() for a in class_info.get('armorTraining').split(',')])
     if armor_profs:
         prof_list.extend(sorted(armor_profs))
@@ -514,52 +1327,29 @@ def fill_template(template_file, data, output_file):
     if data.get('toolProficiencies'):
         prof_list.extend(data.get('toolProficiencies'))
     
-    proficiencies = ', '.join(prof_list) if prof_list else 'None'
-    
-    # Get species information safely
-    species_data = data.get('species', {})
-    if not isinstance(species_data, dict):
-        species_data = {}
-    
-    species_name = species_data.get('name', 'Unknown')
-    species_description = species_data.get('description', '')
-    size = species_data.get('size', 'Medium')
-    speed = species_data.get('speed', data.get('speed', '30 ft.'))
-    
-    # Extract species features (traits)
-    species_features = extract_features(species_data.get('traits', []))
-    
-    # Extract class features from featuresAndTraits
-    class_features = extract_features(data.get('featuresAndTraits', []))
-    
-    # Extract feats
-    feats = extract_features(data.get('feats', []))
-    
-    # Collect all spellcasting classes and generate sections
-    features_list = data.get('featuresAndTraits', [])
-    all_spells = data.get('spells', [])
+    return ', '.join(prof_list) if prof_list else 'None'
+
+def _spellcasting_section(character):
+    """Spell attack, save DC and slots for every class that has spell slots"""
+    index = character.index
+    features_list = character.data.get('featuresAndTraits', [])
+    proficiency_bonus = character.proficiency_bonus
     spellcasting_sections = ''
-    spells_sections = ''
     
-    for class_info in data.get('class', []):
-        if isinstance(class_info, dict) and class_info.get('spellAbility'):
+    for class_info in index.classes:
+        if class_info.get('spellAbility'):
             class_name = class_info.get('name', 'Unknown')
             
             # Extract spell slots for this specific class
-            spell_slots = extract_spell_slots(class_info, features_list)
+            spell_slots = extract_spell_slots(class_info, features_list, index)
             
             # Only create section if class actually has spell slots
             if spell_slots != "No spell slots available":
                 spell_ability = class_info.get('spellAbility')
-                spell_score = abilities.get(spell_ability, 10)
-                try:
-                    spell_score = int(spell_score)
-                except (ValueError, TypeError):
-                    spell_score = 10
-                spell_mod = (spell_score - 10) // 2
+                spell_mod = character.modifier(spell_ability)
                 spell_attack = proficiency_bonus + spell_mod
                 spell_dc = 8 + proficiency_bonus + spell_mod
-                spell_attack_str = f"+{spell_attack}" if spell_attack >= 0 else str(spell_attack)
+                spell_attack_str = signed(spell_attack)
                 
                 spellcasting_sections += f'''
             <div class="section">
@@ -581,95 +1371,434 @@ def fill_template(template_file, data, output_file):
                 <div class="content-box">{spell_slots}</div>
             </div>
             '''
-    
-    # Single unified spell list with all spells
-    if all_spells:
-        spells_short, _ = extract_spells(all_spells)
-        spells_sections = f'''
+    return spellcasting_sections
+
+def _spells_section(character):
+    """Single unified spell list with all spells"""
+    if not character.data.get('spells', []):
+        return ''
+    spells_short, _ = character.spell_lists
+    return f'''
             <div class="section">
                 <h2>Spells</h2>
                 <div class="content-box">{spells_short}</div>
             </div>
             '''
-    
-    # Single spell details section for all spells
-    _, all_spells_detailed = extract_spells(all_spells)
-    spell_details_sections = f'''
+
+def _spell_details_section(character):
+    """Single spell details section for all spells"""
+    _, all_spells_detailed = character.spell_lists
+    return f'''
         <div class="section">
             <h2>Spell Details</h2>
             <div class="content-box">{all_spells_detailed}</div>
         </div>
         '''
-    
-    # Extract weapons and inventory
-    equipment_data = data.get('equipment', [])
-    weapons = extract_weapons(equipment_data, proficiency_bonus)
-    inventory = extract_inventory(equipment_data)
-    
-    # Extract actions
-    actions = extract_actions(data)
-    
-    # Extract bio information
+
+def _bio_section(character):
+    """Bio text plus age, height, weight, eyes, hair and skin"""
+    data = character.data
     bio_parts = []
     if data.get('bio'):
         bio_content = data.get('bio').replace('\n', '<br>')
         bio_parts.append(f'<div class="feature-item"><strong>Bio</strong><div class="feature-text">{bio_content}</div></div>')
-    if data.get('age'):
-        bio_parts.append(f'<div class="feature-item"><strong>Age</strong><div class="feature-text">{data.get("age")}</div></div>')
-    if data.get('height'):
-        bio_parts.append(f'<div class="feature-item"><strong>Height</strong><div class="feature-text">{data.get("height")}</div></div>')
-    if data.get('weight'):
-        bio_parts.append(f'<div class="feature-item"><strong>Weight</strong><div class="feature-text">{data.get("weight")}</div></div>')
-    if data.get('eyes'):
-        bio_parts.append(f'<div class="feature-item"><strong>Eyes</strong><div class="feature-text">{data.get("eyes")}</div></div>')
-    if data.get('hair'):
-        bio_parts.append(f'<div class="feature-item"><strong>Hair</strong><div class="feature-text">{data.get("hair")}</div></div>')
-    if data.get('skin'):
-        bio_parts.append(f'<div class="feature-item"><strong>Skin</strong><div class="feature-text">{data.get("skin")}</div></div>')
-    
-    bio = ''.join(bio_parts) if bio_parts else "No bio information available"
-    
-    template_data = {
-        'character_name': data.get('name', 'Unknown'),
-        'species_name': species_name,
-        'species_description': species_description,
-        'size': size,
-        'speed': speed,
-        'classes': ' / '.join(classes_info) if classes_info else 'Unknown',
-        'background': background_name,
-        'alignment': alignment,
-        'max_hp': max_hp,
-        'armor_class': armor_class,
-        'species_features': species_features,
-        'class_features': class_features,
-        'feats': feats,
-        'spellcasting_sections': spellcasting_sections,
-        'spells_sections': spells_sections,
-        'spell_details_sections': spell_details_sections,
-        'actions': actions,
-        'weapons': weapons,
-        'inventory': inventory,
-        'bio': bio,
-        'notes': notes_text,
-        'abilities_skills_grouped': abilities_skills_grouped,
-        'proficiency_bonus': f'+{proficiency_bonus}',
-        'initiative': initiative,
-        'passive_perception': passive_perception,
-        'hit_dice': hit_dice_str,
-        'languages': languages,
-        'proficiencies': proficiencies
-    }
+    for field, label in (('age', 'Age'), ('height', 'Height'), ('weight', 'Weight'),
+                         ('eyes', 'Eyes'), ('hair', 'Hair'), ('skin', 'Skin')):
+        if data.get(field):
+            bio_parts.append(f'<div class="feature-item"><strong>{label}</strong><div class="feature-text">{data.get(field)}</div></div>')
+    
+    return ''.join(bio_parts) if bio_parts else "No bio information available"
+
+_ABILITY_FIELDS = ('abilityScores', 'attributes')
+_SKILL_FIELDS = _ABILITY_FIELDS + ('proficiencyBonus', 'skillProficiencies', 'skillExpertise')
+
+# Every template_data key: the top-level export fields it reads and how to
+# compute it. The field lists let render_sheet(incremental=True) reuse the
+# previous render of a section whose inputs did not change.
+SECTIONS = {
+    'character_name': (('name',), lambda c: c.data.get('name', 'Unknown')),
+    'species_name': (('species',), lambda c: c.species.get('name', 'Unknown')),
+    'species_description': (('species',), lambda c: c.species.get('description', '')),
+    'size': (('species',), lambda c: c.species.get('size', 'Medium')),
+    'speed': (('species', 'speed'), lambda c: c.species.get('speed', c.data.get('speed', '30 ft.'))),
+    'classes': (('class',), _classes_section),
+    'background': (('background',), _background_section),
+    'alignment': (('alignment',), lambda c: c.data.get('alignment', 'Unknown')),
+    'max_hp': (('maxHP', 'currentHP'), lambda c: c.data.get('maxHP', c.data.get('currentHP', 'Unknown'))),
+    'armor_class': (('armorClass',), lambda c: c.data.get('armorClass', 'Unknown')),
+    'species_features': (('species',), lambda c: extract_features(c.species.get('traits', []))),
+    'class_features': (('featuresAndTraits',), lambda c: extract_features(c.data.get('featuresAndTraits', []))),
+    'feats': (('feats',), lambda c: extract_features(c.data.get('feats', []))),
+    'spellcasting_sections': (('class', 'featuresAndTraits', 'proficiencyBonus') + _ABILITY_FIELDS, _spellcasting_section),
+    'spells_sections': (('spells',), _spells_section),
+    'spell_details_sections': (('spells',), _spell_details_section),
+    'actions': (('equipment', 'species', 'featuresAndTraits', 'class', 'proficiencyBonus') + _ABILITY_FIELDS,
+                lambda c: extract_actions(c.data, c.index, c)),
+    'weapons': (('equipment', 'proficiencyBonus'),
+                lambda c: extract_weapons(c.data.get('equipment', []), c.proficiency_bonus, c.index)),
+    'inventory': (('equipment',), lambda c: extract_inventory(c.data.get('equipment', []), c.index)),
+    'bio': (('bio', 'age', 'height', 'weight', 'eyes', 'hair', 'skin'), _bio_section),
+    'notes': (('notes', 'archivedNotes'), _notes_section),
+    'abilities_skills_grouped': (_SKILL_FIELDS, _abilities_section),
+    'proficiency_bonus': (('proficiencyBonus',), lambda c: f'+{c.proficiency_bonus}'),
+    'initiative': (_ABILITY_FIELDS, lambda c: signed(c.modifier('Dexterity'))),
+    'passive_perception': (_SKILL_FIELDS, lambda c: c.passive_perception),
+    'hit_dice': (('class',), _hit_dice_section),
+    'languages': (('languages',), _languages_section),
+    'proficiencies': (('weaponProficiencies', 'class', 'toolProficiencies'), _proficiencies_section),
+}
+
+# Sections from the last incremental render of each character id
+section_history = FragmentCache(int(os.environ.get('SECTION_HISTORY_SIZE', '256')))
+
+def iter_sections(character, names=SECTIONS, incremental=False, timings=None):
+    """Yield (name, template value) for each named section, computing each only when reached
+    
+    With incremental=True, sections whose input fields hash the same as in
+    the previous render of the same character id are reused from that render;
+    the history is updated once every section has been yielded. Exports whose
+    id is not a string or number are rendered in full.
+    If timings is a dict, each computed section's seconds go in 'section.<name>'.
+    """
+    character_id = character.data.get('id') if incremental else None
+    if not isinstance(character_id, (str, int)):
+        # Lists, objects and other malformed ids cannot key the history
+        character_id = None
+    previous = {}
+    if character_id:
+        history = section_history.get(('sections', character_id))
+        if history and history[0] == RENDERER_FINGERPRINT:
+            previous = history[1]
+    
+    rendered = {}
+    for name in names:
+        fields, compute = SECTIONS[name]
+        if character_id:
+            digest = character.fields_digest(fields)
+            cached = previous.get(name)
+            if cached and cached[0] == digest:
+                value = cached[1]
+                rendered[name] = (digest, value)
+                yield name, value
+                continue
+        if timings is None:
+            value = compute(character)
+        else:
+            start = time.perf_counter()
+            value = compute(character)
+            timings['section.' + name] = time.perf_counter() - start
+        if character_id:
+            rendered[name] = (digest, value)
+        yield name, value
+    
+    if character_id and rendered:
+        # Merged, so rendering a subset of sections keeps the others' history
+        section_history.put(('sections', character_id), (RENDERER_FINGERPRINT, {**previous, **rendered}))
+
+def build_template_data(character, incremental=False, timings=None):
+    """Compute every section's template value for a character (see iter_sections)"""
+    return dict(iter_sections(character, SECTIONS, incremental, timings))
+
+# Heavy, rarely viewed sections render_sheet_parts can defer, with their placeholder labels
+LAZY_SECTIONS = {'spell_details_sections': 'Spell Details', 'inventory': 'Inventory'}
+# Deferring a section smaller than this costs more in requests than it saves
+LAZY_MIN_BYTES = int(os.environ.get('LAZY_MIN_BYTES', '2048'))
+
+def _lazy_placeholder(label):
+    """Pattern matching the LAZY_SECTION placeholder for label, whatever its URL"""
+    before, after = LAZY_SECTION.substitute(url='\0', label=label).split('\0')
+    return re.compile(re.escape(before) + '[^"]*' + re.escape(after))
+
+_LAZY_PLACEHOLDERS = {name: _lazy_placeholder(label) for name, label in LAZY_SECTIONS.items()}
+
+def _defer_section(name, value, section_url, fragments, minify):
+    """A LAZY_SECTION placeholder for a deferrable section big enough to defer, else value
+    
+    The deferred HTML is stored in fragments[name].
+    """
+    html = str(value)
+    if name not in LAZY_SECTIONS or len(html) < LAZY_MIN_BYTES:
+        return value
+    fragments[name] = minify_html(html) if minify else html
+    return LAZY_SECTION.substitute(url=section_url(name), label=LAZY_SECTIONS[name])
+
+def render_sheet(data, template_file='character_template.html', incremental=False,
+                 stylesheet_url=None, minify=False):
+    """Fill HTML template with JSON data and return the HTML as a string
+    
+    incremental=True only recomputes the sections whose inputs changed since
+    the last incremental render of the same character id. stylesheet_url and
+    minify select the linked-CSS and minified output modes of load_template.
+    """
+    return render_sheet_parts(data, template_file, incremental, stylesheet_url, minify)[0]
+
+def render_sheet_parts(data, template_file='character_template.html', incremental=False,
+                       stylesheet_url=None, minify=False, section_url=None, timings=None):
+    """Like render_sheet, but returns (html, fragments) with heavy sections deferred
+    
+    When section_url is given, each LAZY_SECTIONS section of at least
+    LAZY_MIN_BYTES is left out of the page: a collapsed placeholder fetches it
+    from section_url(name) when opened, and its HTML is returned in the
+    fragments dict for the caller to serve. If timings is a dict, the seconds
+    spent loading the template, in each section and joining the page are
+    added to it.
+    """
+    pages, fragments = render_plan(data, [template_file], incremental, stylesheet_url, minify, section_url, timings)
+    return pages[0], fragments
+
+def template_sections(templates):
+    """Names of the SECTIONS any of the compiled templates references, in SECTIONS order"""
+    used = frozenset().union(*(template.placeholders for template in templates))
+    return [name for name in SECTIONS if name in used]
+
+def render_plan(data, template_files, incremental=False, stylesheet_url=None, minify=False,
+                section_url=None, timings=None, template_data=None):
+    """Fill several templates from one pass over the sections they reference
+    
+    Each section some template uses is computed once and shared, and the
+    rest are skipped, so N templates cost about one render. Returns (pages,
+    fragments) with a page per template file. stylesheet_url and section_url
+    (see render_sheet_parts) apply to the first template only, the page whose
+    stylesheet and deferred sections get served. template_data holds section
+    values already computed, e.g. by stream_sheet_parts.
+    """
+    with timed(timings, 'template'):
+        templates = [load_template(template_files[0], stylesheet_url, minify)]
+        templates += [load_template(template_file, minify=minify) for template_file in template_files[1:]]
+    template_data = dict(template_data or {})
+    with timed(timings, 'sections'):
+        names = [name for name in template_sections(templates) if name not in template_data]
+        if names:
+            template_data.update(iter_sections(Character(data), names, incremental, timings))
+    
+    fragments = {}
+    page_data = [template_data] * len(templates)
+    if section_url:
+        page_data[0] = dict(template_data)
+        for name in LAZY_SECTIONS:
+            if name in page_data[0]:
+                page_data[0][name] = _defer_section(name, page_data[0][name], section_url, fragments, minify)
     
     try:
-        filled_content = template.safe_substitute(template_data)
+        with timed(timings, 'join'):
+            pages = []
+            for template, values in zip(templates, page_data):
+                html = template.render(values)
+                # Section markup carries its own f-string indentation
+                pages.append(minify_html(html) if template.minify else html)
+        return pages, fragments
     except Exception as e:
         raise Exception(f"Error filling template: {e}")
-    
+
+def stream_sheet_parts(data, template_file='character_template.html', incremental=False,
+                       stylesheet_url=None, minify=False, section_url=None, fragments=None, timings=None,
+                       sections=None):
+    """Yield the page of render_sheet_parts in document order as it is rendered
+    
+    Each section is computed only when the template reaches it, and the text
+    before it is yielded first, so the top of the sheet does not wait for
+    slow sections further down. The chunks join to render_sheet_parts' html;
+    deferred sections are stored in the fragments dict if one is given, and
+    every computed section's value in the sections dict.
+    """
+    template = load_template(template_file, stylesheet_url, minify)
+    fragments = {} if fragments is None else fragments
+    sections = {} if sections is None else sections
+    names = list(dict.fromkeys(name for name, _ in template.segments if name in SECTIONS))
+    computed = iter_sections(Character(data), names, incremental, timings)
+    values = {}
+    pending = []
+    for name, text in template.segments:
+        if name in SECTIONS and name not in values:
+            chunk = ''.join(pending)
+            pending = []
+            if template.minify:
+                # Hold back a trailing '>' and whitespace that may collapse with the next chunk
+                body = chunk.rstrip()
+                if body.endswith('>'):
+                    pending.append(chunk[len(body) - 1:])
+                    chunk = body[:-1]
+                chunk = minify_html(chunk)
+            if chunk:
+                yield chunk
+            _, value = next(computed)
+            sections[name] = value
+            values[name] = _defer_section(name, value, section_url, fragments, template.minify) if section_url else value
+        pending.append(str(values[name]) if name in values else text)
+    # Finish the generator so the incremental section history is saved
+    for _ in computed:
+        pass
+    chunk = ''.join(pending)
+    yield minify_html(chunk) if template.minify else chunk
+
+def expand_lazy_sections(html, fragments):
+    """Put deferred sections back into a page rendered by render_sheet_parts"""
+    for name, placeholder in _LAZY_PLACEHOLDERS.items():
+        if name in fragments:
+            html = placeholder.sub(lambda m: fragments[name], html, count=1)
+    return html
+
+def warmup(template_file='character_template.html', stylesheet_url=None, minify=False, exports=(),
+           variant_templates=()):
+    """Do the one-off work of a first render ahead of time
+    
+    Compiles the page template and its standalone stylesheet for the given
+    output mode, and any variant_templates rendered alongside it, then
+    renders each export in exports (files, directories or glob patterns) to
+    seed fragment_cache. Run before forking workers, they all share the
+    result. Returns {'exports', 'failed', 'fragments', 'seconds'}.
+    """
+    start = time.perf_counter()
+    load_template(template_file, stylesheet_url, minify)
+    template_stylesheet(template_file)
+    for variant_template in variant_templates:
+        # render_plan applies stylesheet_url to the first template only
+        load_template(variant_template, minify=minify)
+    rendered = failed = 0
+    for json_file in collect_json_files(exports):
+        try:
+            render_sheet_parts(load_json_data(json_file), template_file,
+                               stylesheet_url=stylesheet_url, minify=minify)
+            rendered += 1
+        except Exception:
+            failed += 1
+    return {
+        'exports': rendered,
+        'failed': failed,
+        'fragments': fragment_cache.stats()['entries'],
+        'seconds': time.perf_counter() - start,
+    }
+
+def collect_json_files(inputs):
+    """Expand files, directories and glob patterns into a sorted list of JSON files"""
+    found = set()
+    for pattern in inputs:
+        matches = glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    found.update(os.path.join(root, name) for name in files if name.endswith('.json'))
+            elif os.path.isfile(path):
+                found.add(path)
+    return sorted(found)
+
+def _batch_output_paths(json_files, output_dir):
+    """Map each input to <stem>.html, next to it or in output_dir, without collisions"""
+    outputs = {}
+    used = set()
+    for json_file in json_files:
+        directory = output_dir or os.path.dirname(json_file)
+        stem = os.path.splitext(os.path.basename(json_file))[0]
+        output_file = os.path.join(directory, stem + '.html')
+        suffix = 2
+        while output_file in used:
+            output_file = os.path.join(directory, f"{stem}-{suffix}.html")
+            suffix += 1
+        used.add(output_file)
+        outputs[json_file] = output_file
+    return outputs
+
+def _init_batch_worker(template_file, minify=False):
+    """Compile the template once per worker process"""
+    load_template(template_file, minify=minify)
+
+def _render_batch_file(json_file, output_file, template_file, selective, minify=False):
+    """Render one export for run_batch, returning (seconds, error message or None)"""
+    start = time.perf_counter()
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(filled_content)
+        data = load_json_data(json_file, selective)
+        fill_template(template_file, data, output_file, minify)
+        return time.perf_counter() - start, None
     except Exception as e:
-        raise Exception(f"Error writing output file: {e}")
+        return time.perf_counter() - start, str(e)
+
+def run_batch(inputs, output_dir=None, template_file="character_template.html",
+              jobs=None, selective=False, slowest=5, progress=None, minify=False):
+    """Render many exports over a process pool, continuing past per-file errors
+    
+    Each worker compiles the template once and writes its sheet as soon as it
+    is rendered. Returns a summary with throughput, failures and the slowest
+    inputs. progress, if given, is called with (json_file, seconds, error).
+    """
+    json_files = collect_json_files(inputs)
+    output_paths = _batch_output_paths(json_files, output_dir)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    load_template(template_file, minify=minify)
+    
+    timings = []
+    failures = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                             initargs=(template_file, minify)) as pool:
+        futures = {
+            pool.submit(_render_batch_file, json_file, output_paths[json_file], template_file, selective, minify): json_file
+            for json_file in json_files
+        }
+        for future in as_completed(futures):
+            json_file = futures[future]
+            try:
+                seconds, error = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. out of memory)
+                seconds, error = 0.0, f"Worker failed: {e}"
+            timings.append((seconds, json_file))
+            if error:
+                failures.append((json_file, error))
+            if progress:
+                progress(json_file, seconds, error)
+    elapsed = time.perf_counter() - start
+    
+    return {
+        'files': len(json_files),
+        'succeeded': len(json_files) - len(failures),
+        'failed': len(failures),
+        'failures': sorted(failures),
+        'seconds': elapsed,
+        'files_per_second': len(json_files) / elapsed if elapsed > 0 else 0.0,
+        'slowest': sorted(timings, reverse=True)[:slowest],
+    }
+
+def batch_main(argv):
+    """Command line entry point for --batch"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        prog='generate_character_sheet.py --batch',
+        description='Render every character JSON file found in the given files, directories or globs.')
+    parser.add_argument('inputs', nargs='+', help='JSON files, directories or glob patterns')
+    parser.add_argument('-o', '--output-dir', help='Write sheets here (default: next to each input)')
+    parser.add_argument('-t', '--template', default='character_template.html', help='Template file')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--selective', action='store_true', help='Only parse the fields the renderer reads')
+    parser.add_argument('--minify', action='store_true', help='Strip comments and indentation from the sheets')
+    parser.add_argument('--slowest', type=int, default=5, help='How many of the slowest inputs to report')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only print the final report')
+    args = parser.parse_args(argv)
+    
+    if not os.path.exists(args.template):
+        print(f"Error: Template file not found: {args.template}")
+        return 1
+    
+    def progress(json_file, seconds, error):
+        if error:
+            print(f"FAILED  {json_file}: {error}")
+        elif not args.quiet:
+            print(f"ok      {json_file} ({seconds * 1000:.1f} ms)")
+    
+    summary = run_batch(args.inputs, args.output_dir, args.template, args.jobs,
+                        args.selective, args.slowest, progress, args.minify)
+    if not summary['files']:
+        print("Error: No JSON files found")
+        return 1
+    
+    print(f"\nRendered {summary['succeeded']}/{summary['files']} files in {summary['seconds']:.2f}s "
+          f"({summary['files_per_second']:.1f} files/sec), {summary['failed']} failed")
+    if summary['slowest']:
+        print("Slowest inputs:")
+        for seconds, json_file in summary['slowest']:
+            print(f"    {seconds * 1000:8.1f} ms  {json_file}")
+    return 1 if summary['failed'] else 0
 
 def main():
     """Main function with command line argument support"""
@@ -688,22 +1817,38 @@ Character Sheet Generator - Usage
 
 USAGE:
     python generate_character_sheet.py <json_file> [output_file] [template_file]
+    python generate_character_sheet.py --batch <inputs>... [options]
 
 ARGUMENTS:
     <json_file>         (Required) Path to the character JSON file
     [output_file]       (Optional) Output HTML file (default: <json_file>.html)
     [template_file]     (Optional) Template file (default: character_template.html)
 
+BATCH MODE:
+    <inputs>            JSON files, directories or glob patterns
+    -o, --output-dir    Write sheets here (default: next to each input)
+    -t, --template      Template file (default: character_template.html)
+    -j, --jobs          Worker processes (default: CPU count)
+    --selective         Only parse the fields the renderer reads
+    --minify            Strip comments and indentation from the sheets
+    --slowest N         How many of the slowest inputs to report (default: 5)
+    -q, --quiet         Only print the final report
+
 EXAMPLES:
     python generate_character_sheet.py my_character.json
     python generate_character_sheet.py my_character.json my_sheet.html
     python generate_character_sheet.py my_character.json my_sheet.html custom_template.html
+    python generate_character_sheet.py --batch campaigns/ -o sheets/ -j 8
+    python generate_character_sheet.py --batch "archive/**/*.json" --quiet
 
 HELP:
     python generate_character_sheet.py --help
         """)
         return 0
     
+    if len(sys.argv) > 1 and sys.argv[1] == '--batch':
+        return batch_main(sys.argv[2:])
+    
     # Check for required JSON file argument
     if len(sys.argv) < 2:
         print("Error: Missing required argument <json_file>")
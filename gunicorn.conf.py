@@ -0,0 +1,13 @@
+import time
+
+# Import the app once in the master, so its warm-up (compiled templates,
+# regexes, seeded fragment cache) is shared copy-on-write by every worker
+preload_app = True
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+def post_worker_init(worker):
+    import app
+    app.worker_startup_seconds = time.perf_counter() - worker.forked_at
+    worker.log.info(f"Worker {worker.pid} ready in {app.worker_startup_seconds * 1000:.1f} ms")
@@ -0,0 +1,334 @@
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from generate_character_sheet import collect_json_files
+
+OPERATIONS = ('upload', 'view', 'download')
+
+def parse_mix(text):
+    """'upload=1,view=4,download=1' -> {'upload': 1.0, 'view': 4.0, 'download': 1.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation in mix: {name}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("The mix needs at least one operation with a positive weight")
+    return mix
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def load_corpus(inputs, synthetic=0, seed=0):
+    """List of (name, raw bytes) exports from files/directories/globs and/or generated ones"""
+    corpus = []
+    for path in collect_json_files(inputs):
+        with open(path, 'rb') as f:
+            corpus.append((os.path.basename(path), f.read()))
+    if synthetic:
+        from benchmark import generate_character
+        rng = random.Random(seed)
+        for number in range(synthetic):
+            data = generate_character(seed=seed + number, spells=rng.randint(5, 80),
+                                      equipment=rng.randint(5, 80), features=rng.randint(5, 60))
+            corpus.append((f"synthetic_{number}.json", json.dumps(data).encode('utf-8')))
+    return corpus
+
+def process_rss_kb(pid):
+    """Resident set size of a process in KB, or None if it cannot be read"""
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def child_pids(pid):
+    """Direct children of a process, e.g. the workers of a gunicorn master"""
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children", 'r') as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+class InProcessClient:
+    """Flask test client for app.app, one per load thread"""
+
+    def __init__(self):
+        import app
+        self.client = app.app.test_client()
+
+    def upload(self, name, raw):
+        import io
+        response = self.client.post('/upload', data={'file': (io.BytesIO(raw), name)})
+        return response.status_code, response.get_json(silent=True) or {}, len(response.data)
+
+    def get(self, path):
+        response = self.client.get(path, headers={'Accept-Encoding': 'gzip'})
+        return response.status_code, len(response.data)
+
+class HttpClient:
+    """Plain urllib client for a server listening on a real socket"""
+
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _send(self, request):
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def upload(self, name, raw):
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+                f'Content-Type: application/json\r\n\r\n').encode('utf-8') + raw + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        request = urllib.request.Request(self.base_url + '/upload', data=body, method='POST',
+                                         headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        status, data = self._send(request)
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            payload = {}
+        return status, payload, len(data)
+
+    def get(self, path):
+        status, data = self._send(urllib.request.Request(self.base_url + path, headers={'Accept-Encoding': 'gzip'}))
+        return status, len(data)
+
+def start_local_server():
+    """Serve app.app on an ephemeral localhost port from a background thread; returns its base URL"""
+    from werkzeug.serving import make_server
+    import app
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+class LoadTest:
+    """Closed-loop (concurrency) or open-loop (rate) mix of uploads, views and downloads"""
+
+    def __init__(self, make_client, corpus, mix, concurrency=8, duration=30.0, requests=None,
+                 rate=None, seed=0, pids=None):
+        self.make_client = make_client
+        self.corpus = corpus
+        self.mix = mix
+        self.concurrency = concurrency
+        self.duration = duration
+        self.requests = requests
+        self.rate = rate
+        self.seed = seed
+        self.pids = pids or (lambda: [os.getpid()])
+        self._lock = threading.Lock()
+        self.sheets = []
+        self.latencies = {name: [] for name in OPERATIONS}
+        self.errors = {}
+        self.bytes_received = 0
+        self.issued = 0
+        self.peak_rss = {}
+
+    def _next_slot(self):
+        """Claim the next request, returning its scheduled start time, or None when done"""
+        with self._lock:
+            if self.requests is not None and self.issued >= self.requests:
+                return None
+            number = self.issued
+            self.issued += 1
+        if self.rate:
+            return self.started + number / self.rate
+        return time.perf_counter()
+
+    def _record(self, operation, seconds, status, size):
+        with self._lock:
+            self.latencies[operation].append(seconds)
+            self.bytes_received += size
+            if status >= 400 or status == 0:
+                key = f"{operation} {status}"
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def _worker(self, number):
+        rng = random.Random(self.seed * 1000 + number)
+        client = self.make_client()
+        operations = list(self.mix)
+        weights = [self.mix[name] for name in operations]
+        while True:
+            scheduled = self._next_slot()
+            if scheduled is None or time.perf_counter() >= self.deadline:
+                return
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            operation = rng.choices(operations, weights)[0]
+            with self._lock:
+                sheet = rng.choice(self.sheets) if self.sheets else None
+            if sheet is None:
+                # Nothing to view yet
+                operation = 'upload'
+            # Open-loop latency counts from the scheduled start, so queueing shows up
+            start = scheduled if self.rate else time.perf_counter()
+            try:
+                if operation == 'upload':
+                    name, raw = rng.choice(self.corpus)
+                    status, payload, size = client.upload(name, raw)
+                    if status == 200 and payload.get('output_file'):
+                        with self._lock:
+                            if payload['output_file'] not in self.sheets:
+                                self.sheets.append(payload['output_file'])
+                else:
+                    status, size = client.get(f"/{operation}/{sheet}")
+            except Exception as e:
+                status, size = 0, 0
+                logging.getLogger(__name__).debug(f"{operation} failed: {e}")
+            self._record(operation, time.perf_counter() - start, status, size)
+
+    def _sample_rss(self, stop):
+        while not stop.wait(0.25):
+            for pid in self.pids():
+                rss = process_rss_kb(pid)
+                if rss is not None:
+                    self.peak_rss[pid] = max(self.peak_rss.get(pid, 0), rss)
+
+    def run(self):
+        """Run the load and return the report dict"""
+        self.started = time.perf_counter()
+        self.deadline = self.started + self.duration if self.duration else float('inf')
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample_rss, args=(stop,), daemon=True)
+        sampler.start()
+        threads = [threading.Thread(target=self._worker, args=(number,)) for number in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - self.started
+        stop.set()
+        sampler.join()
+        for pid in self.pids():
+            rss = process_rss_kb(pid)
+            if rss is not None:
+                self.peak_rss[pid] = max(self.peak_rss.get(pid, 0), rss)
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        total = sum(len(values) for values in self.latencies.values())
+        operations = {}
+        for name, values in self.latencies.items():
+            if not values:
+                continue
+            values = sorted(values)
+            operations[name] = {
+                'requests': len(values),
+                'per_second': round(len(values) / elapsed, 2),
+                'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+                'max_ms': round(values[-1] * 1000, 2),
+            }
+        return {
+            'seconds': round(elapsed, 3),
+            'requests': total,
+            'per_second': round(total / elapsed, 2) if elapsed > 0 else 0.0,
+            'errors': sum(self.errors.values()),
+            'errors_by_status': self.errors,
+            'bytes_received': self.bytes_received,
+            'operations': operations,
+            'peak_rss_kb': {str(pid): rss for pid, rss in sorted(self.peak_rss.items())},
+        }
+
+def print_report(report):
+    print(f"\n{report['requests']} requests in {report['seconds']:.1f}s "
+          f"({report['per_second']:.1f} req/s), {report['errors']} errors, "
+          f"{report['bytes_received'] / 1024 / 1024:.1f} MB received")
+    print(f"    {'operation':<10} {'count':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, stats in report['operations'].items():
+        print(f"    {name:<10} {stats['requests']:>7} {stats['per_second']:>8.1f} {stats['p50_ms']:>9.1f} "
+              f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+    for key, count in sorted(report['errors_by_status'].items()):
+        print(f"    error {key}: {count}")
+    for pid, rss in report['peak_rss_kb'].items():
+        print(f"    peak RSS pid {pid}: {rss / 1024:.1f} MB")
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(
+        description='Drive the Flask app with a mix of uploads, views and downloads and report latency percentiles.')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help='Load an already running server, e.g. gunicorn at http://127.0.0.1:5000')
+    target.add_argument('--local', action='store_true', help='Serve app.app on a local socket from this process')
+    parser.add_argument('--server-pid', type=int, help='With --url: report RSS of this process and its workers')
+    parser.add_argument('corpus', nargs='*', default=['my_character.json'],
+                        help='Export files, directories or globs to upload (default: my_character.json)')
+    parser.add_argument('--synthetic', type=int, default=0, help='Add this many generated exports to the corpus')
+    parser.add_argument('--mix', default='upload=1,view=4,download=1', help='Weighted operation mix')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='Concurrent sessions')
+    parser.add_argument('-d', '--duration', type=float, default=30.0, help='Seconds to run (0: until --requests)')
+    parser.add_argument('-n', '--requests', type=int, help='Stop after this many requests')
+    parser.add_argument('--rate', type=float, help='Target requests/second (open loop) instead of as fast as possible')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the operation and corpus choices')
+    parser.add_argument('--json', help='Write the report here')
+    args = parser.parse_args(argv)
+
+    if not args.duration and not args.requests:
+        parser.error('give a --duration or a --requests limit')
+    corpus = load_corpus(args.corpus, args.synthetic, args.seed)
+    if not corpus:
+        print("Error: No exports to upload")
+        return 1
+    mix = parse_mix(args.mix)
+
+    logging.getLogger('app').setLevel(logging.WARNING)
+    server = None
+    pids = None
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+        if args.server_pid:
+            pids = lambda: [args.server_pid] + child_pids(args.server_pid)
+        target = args.url
+    elif args.local:
+        base_url, server = start_local_server()
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        make_client = lambda: HttpClient(base_url)
+        target = f"{base_url} (local socket)"
+    else:
+        make_client = InProcessClient
+        target = 'in-process test client'
+
+    print(f"Loading {target}: {len(corpus)} exports, mix {args.mix}, concurrency {args.concurrency}"
+          + (f", {args.rate:g} req/s" if args.rate else ''))
+    try:
+        report = LoadTest(make_client, corpus, mix, args.concurrency, args.duration, args.requests,
+                          args.rate, args.seed, pids).run()
+    finally:
+        if server:
+            server.shutdown()
+    report['target'] = target
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['errors'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import deque
+
+class OverBudget(Exception):
+    """Raised when a render cannot be admitted within the memory budget"""
+
+class Reservation:
+    """Bytes held in a MemoryBudget until released; releasing twice is harmless"""
+
+    def __init__(self, budget, cost):
+        self.budget = budget
+        self.cost = cost
+
+    def resize(self, cost):
+        """Replace the estimate once more is known, without waiting"""
+        self.budget._adjust(self, cost)
+
+    def release(self):
+        self.budget._adjust(self, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class MemoryBudget:
+    """Admits concurrent renders while their estimated bytes fit a per-process budget
+
+    Renders that do not fit wait in arrival order, each for at most its
+    timeout; once max_waiting are waiting, further ones with a timeout are
+    shed with OverBudget straight away. A render larger than the whole
+    budget is admitted once nothing else is in flight, so it is slowed down
+    but never refused.
+    """
+
+    def __init__(self, max_bytes, max_waiting=16):
+        self.max_bytes = max_bytes
+        self.max_waiting = max_waiting
+        self._cond = threading.Condition()
+        self._waiting = deque()
+        self._in_flight = 0
+        self._bytes = 0
+        self._peak = 0
+        self._admitted = 0
+        self._waited = 0
+        self._shed = 0
+
+    def _fits(self, cost):
+        return self._in_flight == 0 or self._bytes + cost <= self.max_bytes
+
+    def reserve(self, cost, timeout=None):
+        """Reservation of cost bytes, waiting up to timeout seconds for room
+
+        With timeout=None it waits as long as it takes and is never shed.
+        """
+        with self._cond:
+            if self._waiting or not self._fits(cost):
+                # Callers prepared to wait forever (background jobs) are never shed
+                if timeout is not None and len(self._waiting) >= self.max_waiting:
+                    self._shed += 1
+                    raise OverBudget(f"{len(self._waiting)} renders already waiting for memory")
+                deadline = None if timeout is None else time.monotonic() + timeout
+                ticket = object()
+                self._waiting.append(ticket)
+                self._waited += 1
+                try:
+                    while self._waiting[0] is not ticket or not self._fits(cost):
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            self._shed += 1
+                            raise OverBudget(f"No room for a {cost} byte render within {timeout}s")
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting.remove(ticket)
+                    # The next in line may fit now, or may have been waiting behind this one
+                    self._cond.notify_all()
+            self._in_flight += 1
+            self._bytes += cost
+            self._peak = max(self._peak, self._bytes)
+            self._admitted += 1
+        return Reservation(self, cost)
+
+    def _adjust(self, reservation, cost):
+        with self._cond:
+            if reservation.cost is None:
+                return
+            self._bytes -= reservation.cost
+            if cost is None:
+                self._in_flight -= 1
+            else:
+                self._bytes += cost
+                self._peak = max(self._peak, self._bytes)
+            reservation.cost = cost
+            self._cond.notify_all()
+
+    def stats(self):
+        """Bytes and renders in flight, the peak, and admission counters"""
+        with self._cond:
+            return {
+                'budget_bytes': self.max_bytes,
+                'in_flight_bytes': self._bytes,
+                'peak_bytes': self._peak,
+                'in_flight': self._in_flight,
+                'waiting': len(self._waiting),
+                'admitted': self._admitted,
+                'waited': self._waited,
+                'shed': self._shed,
+            }
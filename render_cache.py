@@ -0,0 +1,135 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS renders (
+    key TEXT PRIMARY KEY,
+    character_name TEXT,
+    html BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS renders_last_used ON renders (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+def content_key(raw_bytes, version):
+    """Cache key for an export from its raw JSON bytes"""
+    digest = hashlib.sha256(version.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(raw_bytes)
+    return 'sha256:' + digest.hexdigest()
+
+class RenderCache:
+    """Size-capped LRU of rendered sheets in a SQLite file shared by all workers"""
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Not kept, so no SQLite handle is open when a preloaded app forks
+        conn = self._open()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = self._open()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, conn, name):
+        conn.execute('INSERT INTO counters (name, value) VALUES (?, 1) '
+                     'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+    def get(self, key):
+        """Return (character_name, html) for key, or None on a miss"""
+        try:
+            conn = self._connect()
+            row = conn.execute('SELECT character_name, html FROM renders WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self._count(conn, 'misses')
+                return None
+            conn.execute('UPDATE renders SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._count(conn, 'hits')
+            character_name, html = row
+            return character_name, html.decode('utf-8')
+        except sqlite3.Error as e:
+            logger.warning(f"Render cache lookup failed: {e}")
+            return None
+
+    def put(self, key, character_name, html):
+        """Store a rendered sheet and evict least recently used entries over the cap"""
+        body = html.encode('utf-8')
+        if len(body) > self.max_bytes:
+            return
+        try:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('INSERT OR REPLACE INTO renders (key, character_name, html, size, last_used) '
+                             'VALUES (?, ?, ?, ?, ?)', (key, character_name, body, len(body), time.time()))
+                self._evict(conn)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"Render cache store failed: {e}")
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM renders').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute('SELECT key, size FROM renders ORDER BY last_used').fetchall():
+            conn.execute('DELETE FROM renders WHERE key = ?', (key,))
+            self._count(conn, 'evictions')
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        """Hit/miss/eviction counters plus current entry count and size"""
+        conn = self._connect()
+        counters = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+        entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM renders').fetchone()
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'evictions': counters.get('evictions', 0),
+            'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+        }
+
+    def clear(self):
+        """Drop every cached render and reset the counters"""
+        conn = self._connect()
+        conn.execute('DELETE FROM renders')
+        conn.execute('DELETE FROM counters')
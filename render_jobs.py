@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_submitted ON jobs (submitted);
+'''
+
+class QueueFull(Exception):
+    """Raised when a render queue is at its depth limit"""
+
+class MemoryJobStore:
+    """Job records for a single process"""
+
+    def __init__(self, max_jobs=1000):
+        self.max_jobs = max_jobs
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, submitted):
+        with self._lock:
+            self._jobs[job_id] = {'id': job_id, 'status': 'queued', 'submitted': submitted,
+                                  'started': None, 'finished': None, 'result': None, 'error': None}
+            # dicts keep insertion order, so the first entries are the oldest jobs
+            while len(self._jobs) > self.max_jobs:
+                del self._jobs[next(iter(self._jobs))]
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+class SqliteJobStore:
+    """Job records in a SQLite file, so any gunicorn worker can answer /status"""
+
+    def __init__(self, path, max_jobs=1000):
+        self.path = path
+        self.max_jobs = max_jobs
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, job_id, submitted):
+        conn = self._connect()
+        conn.execute("INSERT INTO jobs (id, status, submitted) VALUES (?, 'queued', ?)", (job_id, submitted))
+        conn.execute('DELETE FROM jobs WHERE id IN (SELECT id FROM jobs ORDER BY submitted DESC LIMIT -1 OFFSET ?)',
+                     (self.max_jobs,))
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        self._connect().execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        row = self._connect().execute(
+            'SELECT id, status, submitted, started, finished, result, error FROM jobs WHERE id = ?',
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(('id', 'status', 'submitted', 'started', 'finished', 'result', 'error'), row))
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+def _timed_call(fn, args):
+    """Run fn(*args) and report when it actually started and finished
+
+    Module-level so it can be sent to a process pool.
+    """
+    started = time.time()
+    result = fn(*args)
+    return started, time.time(), result
+
+class RenderQueue:
+    """Bounded queue of background render jobs
+
+    Jobs run on executor (a thread pool by default, or e.g. a process pool
+    standing in for a broker). When max_depth jobs are queued or running,
+    submit raises QueueFull so callers can push back on clients.
+    on_result(result) runs in this process when a job succeeds and returns
+    the JSON-able record stored for /status.
+    """
+
+    def __init__(self, max_depth=32, workers=2, executor=None, store=None, on_result=None):
+        self.max_depth = max_depth
+        self.executor = executor or ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+        self.store = store or MemoryJobStore()
+        self.on_result = on_result
+        self._lock = threading.Lock()
+        self.depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) and return its job id, or raise QueueFull"""
+        with self._lock:
+            if self.depth >= self.max_depth:
+                self.rejected += 1
+                raise QueueFull(f"Render queue is full ({self.max_depth} jobs)")
+            self.depth += 1
+            self.submitted += 1
+        
+        job_id = uuid.uuid4().hex
+        submitted = time.time()
+        self.store.create(job_id, submitted)
+        try:
+            future = self.executor.submit(_timed_call, fn, args)
+        except Exception:
+            with self._lock:
+                self.depth -= 1
+            self.store.update(job_id, status='failed', error='Could not start job', finished=time.time())
+            raise
+        future.add_done_callback(lambda f: self._finish(job_id, submitted, f))
+        return job_id
+
+    def _finish(self, job_id, submitted, future):
+        try:
+            started, finished, result = future.result()
+            record = self.on_result(result) if self.on_result else result
+            self.store.update(job_id, status='done', started=started, finished=finished, result=record)
+            logger.info(f"Render job {job_id} done: queued {(started - submitted) * 1000:.0f} ms, "
+                        f"rendered {(finished - started) * 1000:.0f} ms")
+            outcome = 'completed'
+        except Exception as e:
+            logger.error(f"Render job {job_id} failed: {e}")
+            self.store.update(job_id, status='failed', finished=time.time(), error=str(e))
+            outcome = 'failed'
+        with self._lock:
+            self.depth -= 1
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def status(self, job_id):
+        """Job record with queue/render timings in ms, or None if unknown"""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        if job['started']:
+            job['queued_ms'] = round((job['started'] - job['submitted']) * 1000, 1)
+            if job['finished']:
+                job['render_ms'] = round((job['finished'] - job['started']) * 1000, 1)
+        return job
+
+    def stats(self):
+        """Current depth and lifetime counters for this process"""
+        with self._lock:
+            return {
+                'depth': self.depth,
+                'max_depth': self.max_depth,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,96 @@
+import threading
+
+# Histogram buckets in seconds, from sub-millisecond sections to slow uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _labels(labels):
+    """Prometheus label set for a sorted tuple of (name, value) pairs"""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def server_timing(timings):
+    """Server-Timing header value for {name: seconds}"""
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
+
+class Metrics:
+    """In-process counters and histograms rendered in the Prometheus text format
+
+    Each gunicorn worker keeps its own, so a scrape sees the worker that
+    answered it.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def describe(self, name, help_text):
+        """Set the # HELP line for a metric"""
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Record one observation in a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts, then sum and count
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    def render(self, gauges=None):
+        """Prometheus text exposition of every metric, plus {name: value} or {name: [(labels, value)]} gauges"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+
+        def header(name, kind):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        previous = None
+        for (name, labels), value in counters:
+            if name != previous:
+                header(name, 'counter')
+                previous = name
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+        previous = None
+        for (name, labels), (counts, total, count) in histograms:
+            if name != previous:
+                header(name, 'histogram')
+                previous = name
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total!r}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        for name, value in sorted((gauges or {}).items()):
+            header(name, 'gauge')
+            samples = value if isinstance(value, list) else [((), value)]
+            for labels, sample in samples:
+                lines.append(f"{name}{_labels(tuple(sorted(dict(labels).items())))} {_number(sample)}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT PRIMARY KEY,
+    group_name TEXT NOT NULL,
+    etag TEXT,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_group ON entries (group_name);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS entry_blobs (
+    name TEXT NOT NULL,
+    encoding TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (name, encoding)
+);
+CREATE INDEX IF NOT EXISTS entry_blobs_digest ON entry_blobs (digest);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+# Lookups only refresh last_used when it is older than this, so views stay read-only
+TOUCH_INTERVAL = 60
+
+class SheetStore:
+    """Content-addressed files under a byte cap, with LRU and TTL eviction
+
+    Each stored body is written once to blobs/<ab>/<sha256>, however many
+    names refer to it. Names map to one blob per Content-Encoding in a
+    SQLite index shared by all workers, so lookups never stat the blob
+    directory. Entries in the same group (a sheet and its fragments) are
+    evicted together.
+    """
+
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+        # Not kept, so no SQLite handle is open when a preloaded app forks
+        conn = self._open()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _open(self):
+        conn = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'), timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _connect(self):
+        # sqlite3 connections must not cross threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = self._open()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, conn, name, value=1):
+        conn.execute('INSERT INTO counters (name, value) VALUES (?, ?) '
+                     'ON CONFLICT(name) DO UPDATE SET value = value + ?', (name, value, value))
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, 'blobs', digest[:2], digest)
+
+    def _write_blob(self, digest, body):
+        path = self.blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(body)
+        os.replace(temp_path, path)
+
+    def put(self, name, variants, etag=None, group=None):
+        """Store {encoding: bytes} under name, replacing what was there
+
+        Blobs that already exist are reused rather than rewritten. Returns
+        False if the entry alone is larger than the cap.
+        """
+        digests = {encoding: hashlib.sha256(body).hexdigest() for encoding, body in variants.items()}
+        if sum(len(body) for body in variants.values()) > self.max_bytes:
+            logger.warning(f"Not storing {name}: larger than the {self.max_bytes} byte cap")
+            return False
+        now = time.time()
+        conn = self._connect()
+        # Blob files are written and deleted while holding the write lock,
+        # so eviction can never remove a blob a concurrent put just reused
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for encoding, body in variants.items():
+                digest = digests[encoding]
+                if conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone():
+                    self._count(conn, 'deduplicated')
+                    continue
+                self._write_blob(digest, body)
+                conn.execute('INSERT INTO blobs (digest, size) VALUES (?, ?)', (digest, len(body)))
+            replaced = conn.execute('DELETE FROM entry_blobs WHERE name = ?', (name,)).rowcount
+            conn.execute('INSERT OR REPLACE INTO entries (name, group_name, etag, created, last_used) '
+                         'VALUES (?, ?, ?, ?, ?)', (name, group or name, etag, now, now))
+            conn.executemany('INSERT INTO entry_blobs (name, encoding, digest) VALUES (?, ?, ?)',
+                             [(name, encoding, digest) for encoding, digest in digests.items()])
+            if replaced:
+                self._remove_orphans(conn)
+            self._evict(conn, now, keep=group or name)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return True
+
+    def get(self, name):
+        """(etag, {encoding: digest}) for a stored name, or None"""
+        try:
+            conn = self._connect()
+            row = conn.execute('SELECT etag, last_used FROM entries WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return None
+            etag, last_used = row
+            digests = dict(conn.execute('SELECT encoding, digest FROM entry_blobs WHERE name = ?', (name,)).fetchall())
+            now = time.time()
+            if now - last_used > TOUCH_INTERVAL:
+                conn.execute('UPDATE entries SET last_used = ? WHERE name = ?', (now, name))
+            return etag, digests
+        except sqlite3.Error as e:
+            logger.warning(f"Sheet store lookup failed: {e}")
+            return None
+
+    def read(self, digest):
+        """Bytes of a blob, or None if it has been evicted"""
+        try:
+            with open(self.blob_path(digest), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _remove_groups(self, conn, groups):
+        """Delete every entry of the given groups and the blobs nothing else uses"""
+        for group in groups:
+            names = [row[0] for row in conn.execute('SELECT name FROM entries WHERE group_name = ?', (group,))]
+            conn.execute('DELETE FROM entries WHERE group_name = ?', (group,))
+            for name in names:
+                conn.execute('DELETE FROM entry_blobs WHERE name = ?', (name,))
+            self._count(conn, 'evictions', len(names))
+        self._remove_orphans(conn)
+
+    def _remove_orphans(self, conn):
+        """Delete blobs no entry refers to any more"""
+        orphans = conn.execute('SELECT digest FROM blobs WHERE NOT EXISTS '
+                               '(SELECT 1 FROM entry_blobs WHERE entry_blobs.digest = blobs.digest)').fetchall()
+        for (digest,) in orphans:
+            conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self, conn, now, keep=None):
+        if self.ttl:
+            expired = [row[0] for row in conn.execute(
+                'SELECT group_name FROM entries GROUP BY group_name HAVING MAX(last_used) < ?', (now - self.ttl,))]
+            if expired:
+                self._remove_groups(conn, expired)
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        while total > self.max_bytes:
+            row = conn.execute('SELECT group_name FROM entries WHERE group_name != ? GROUP BY group_name '
+                               'ORDER BY MAX(last_used) LIMIT 1', (keep,)).fetchone()
+            if row is None:
+                break
+            self._remove_groups(conn, [row[0]])
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+    def sweep(self):
+        """Apply TTL and size eviction now, without storing anything"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._evict(conn, time.time())
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def stats(self):
+        """Entry/blob counts, bytes on disk and eviction/deduplication counters"""
+        conn = self._connect()
+        counters = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+        entries = conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        blobs, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        return {
+            'entries': entries,
+            'blobs': blobs,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'evictions': counters.get('evictions', 0),
+            'deduplicated': counters.get('deduplicated', 0),
+        }
@@ -78,9 +78,14 @@ async function handleFile(file) {
             body: formData
         });
 
-        const data = await response.json();
+        let data = await response.json();
+
+        // Background render: poll until the job finishes
+        if (response.status === 202 && data.status_url) {
+            data = await waitForJob(data.status_url);
+        }
 
-        if (response.ok && data.success) {
+        if (data.success) {
             showStatus('Character sheet generated successfully!', 'success');
             showResult(data.output_file, data.character_name);
         } else {
@@ -93,6 +98,17 @@ async function handleFile(file) {
     }
 }
 
+async function waitForJob(statusUrl) {
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, 500));
+        const response = await fetch(statusUrl);
+        const data = await response.json();
+        if (!response.ok || data.status === 'done' || data.status === 'failed') {
+            return data;
+        }
+    }
+}
+
 viewBtn.addEventListener('click', () => {
     if (currentOutputFile) {
         window.open(`/view/${currentOutputFile}`, '_blank');
@@ -104,3 +120,11 @@ downloadBtn.addEventListener('click', () => {
         window.location.href = `/download/${currentOutputFile}`;
     }
 });
+
+document.querySelectorAll('.variant-btn').forEach(button => {
+    button.addEventListener('click', () => {
+        if (currentOutputFile) {
+            window.open(`/view/${currentOutputFile}?variant=${button.dataset.variant}`, '_blank');
+        }
+    });
+});